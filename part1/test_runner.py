@@ -5,6 +5,12 @@ from cocotb.runner import get_runner
 
 G_DATA_WIDTH = [8, 16, 24]
 
+# waveform dump per simulator. GHDL writes its own ghw format, nvc writes fst
+WAVE_ARGS = {
+    "ghdl": ["--wave=waveform.ghw"],
+    "nvc": ["--wave=waveform.fst"],
+}
+
 @pytest.mark.parametrize("g_data_width", G_DATA_WIDTH, ids=[f"G_DATA_WIDTH={i}" for i in G_DATA_WIDTH])
 def test_my_design_runner(g_data_width):
 
@@ -30,9 +36,8 @@ def test_my_design_runner(g_data_width):
         hdl_toplevel=hdl_toplevel,
         hdl_toplevel_lang="vhdl",
         seed=1871423625,
-        plusargs=[
-            "--wave=waveform.ghw"
-        ],
+        # run without waveform dump by setting WAVES=False
+        plusargs=WAVE_ARGS.get(sim, []) if os.getenv("WAVES", "True") == "True" else [],
     )
 
 
@@ -44,3 +49,6 @@ if __name__ == "__main__":
 
     ## Otherwise use pytest for parameterized tests
     # SIM=ghdl pytest test_runner.py
+
+    ## Without waveform dump e.g. for a fast run of all parameterized tests
+    # WAVES=False SIM=ghdl pytest test_runner.py
@@ -1,4 +1,5 @@
 import os
+import functools
 import pytest
 from pathlib import Path
 from cocotb.runner import get_runner
@@ -8,6 +9,30 @@ G_DATA_WIDTH = [8, 10, 12, 16]
 G_N_COLOR_COMPONENTS = [3]
 G_PIXEL_PER_CLOCK = [1, 2, 4]
 
+# waveform dump per simulator. GHDL writes its own ghw format, nvc writes fst
+WAVE_ARGS = {
+    "ghdl": ["--wave=waveform.ghw"],
+    "nvc": ["--wave=waveform.fst"],
+}
+
+@functools.lru_cache(maxsize=None)
+def build(sim):
+    # Analyze the sources once per session and share the build for all generics.
+    # Generics are only applied when the design is elaborated and run (ghdl -r ... -gG_DATA_WIDTH=8),
+    # same as the part1 Makefile does
+    proj_path = Path(__file__).resolve().parent
+
+    runner = get_runner(sim)
+
+    runner.build(
+        sources=[proj_path / "axis_design.vhd"],
+        hdl_toplevel="axis_design",
+        always=True # always run the build step
+    )
+
+    return runner
+
+
 @pytest.mark.parametrize("g_data_width", G_DATA_WIDTH, ids=[f" G_DATA_WIDTH={i} " for i in G_DATA_WIDTH])
 @pytest.mark.parametrize("g_n_color_components", G_N_COLOR_COMPONENTS, ids=[f" G_N_COLOR_COMPONENTS={i} " for i in G_N_COLOR_COMPONENTS])
 @pytest.mark.parametrize("g_pixel_per_clock", G_PIXEL_PER_CLOCK, ids=[f" G_PIXEL_PER_CLOCK={i} " for i in G_PIXEL_PER_CLOCK])
@@ -18,31 +43,21 @@ def test_axis_design_runner(
 ):
     sim = os.getenv("SIM", "ghdl")
 
-    proj_path = Path(__file__).resolve().parent
-
-    runner = get_runner(sim)
+    runner = build(sim)
 
     hdl_toplevel = "axis_design"
 
-    runner.build(
-        sources=[proj_path / "axis_design.vhd"],
+    runner.test(
+        test_module="test_axis_design",
         hdl_toplevel=hdl_toplevel,
+        hdl_toplevel_lang="vhdl",
         parameters={
             "G_DATA_WIDTH": g_data_width,
             "G_N_COLOR_COMPONENTS": g_n_color_components,
             "G_PIXEL_PER_CLOCK": g_pixel_per_clock
         },
-        always=True # always run the build step
-    )
-
-    runner.test(
-        test_module="test_axis_design",
-        hdl_toplevel=hdl_toplevel,
-        hdl_toplevel_lang="vhdl",
         seed=1871423625,
-        plusargs=[
-            "--wave=waveform.ghw",
-        ],
+        plusargs=WAVE_ARGS.get(sim, []),
         extra_env={
             # writes result pnm image to disk if "True"
             # use this in combination with a specified testcase
@@ -1,4 +1,7 @@
+import itertools
+import numpy as np
 from cocotbext.axi import AxiStreamFrame
+import utility
 
 class AxiStreamImage:
 
@@ -6,13 +9,16 @@ class AxiStreamImage:
         """
         Initialize the AxiStreamImage with data and dimensions or from a list of AxiStreamFrame
 
-        :param data: all image pixel data. flattened out into a 1D list
+        Image data is held as one contiguous (height x width) NumPy array. AxiStreamFrames
+        for single lines are only created when they are needed, e.g. in send() or __getitem__
+
+        :param data: all image pixel data. flattened out into a 1D list or NumPy array
         :param width: Width of the image in pixels
         :param height: Height of the image in pixels
         :param axis_frames: (optional) list of AxiStreamFrame
         """
         # Check if data has correct length
-        if data:
+        if data is not None:
             if len(data) != (width*height):
                 raise ValueError(f"Length mismatch while creating AxiStreamImage. tdata length is {len(data)} but must be width*height: {(width*height)}")
 
@@ -23,14 +29,17 @@ class AxiStreamImage:
             for frame in axis_frames:
                 if len(frame.tdata) != width:
                     raise ValueError(f"Frame length ({len(frame.tdata)}) does not match width ({width})")
-        
+
         self.width = width
         self.height = height
 
+        # An image is either backed by a pixel array or by a list of AxiStreamFrames (e.g. received frames incl. tuser)
         if axis_frames is None:
-            self.axis_frames = self._build(data)
+            self.pixels = self._build(data)
+            self._axis_frames = None
         else:
-            self.axis_frames = axis_frames
+            self.pixels = None
+            self._axis_frames = axis_frames
 
 
     @classmethod
@@ -42,12 +51,12 @@ class AxiStreamImage:
         """
         if not axis_frames:
             raise ValueError("Frame list cannot be empty")
-        
+
         width = len(axis_frames[0])
         for frame in axis_frames:
             if len(frame.tdata) != width:
                 raise ValueError("All frames must have the same length")
-        
+
         height = len(axis_frames)
 
         return cls(None, width, height, axis_frames)
@@ -55,25 +64,51 @@ class AxiStreamImage:
 
     def _build(self, data):
         """
-        Generate a frame (i.e. line) with specific tuser settings.
+        Store the image data as a (height x width) array with the smallest fitting unsigned dtype.
 
-        Append all frames to a list which represents the whole image.
+        Lazily decoded line sources (e.g. utility.MappedPnm) are kept as they are, lines are then read on demand
 
-        :return: List of AxiStreamFrame objects representing the image
+        :return: NumPy array (or line source) representing the image
+        """
+        if not isinstance(data, (list, tuple, np.ndarray)) and getattr(data, 'shape', None) == (self.height, self.width):
+            return data
+        if isinstance(data, (list, tuple)):
+            # np.asarray() infers float64 for lists that mix small ints with values of 2**63 and above
+            max_value = max(data, default=0)
+            return np.array(data, dtype=utility.fitted_dtype(int(max_value).bit_length())).reshape(self.height, self.width)
+        pixels = np.asarray(data)
+        if pixels.dtype.kind != 'u':
+            max_value = int(np.max(pixels)) if pixels.size else 0
+            pixels = pixels.astype(utility.fitted_dtype(max_value.bit_length()))
+        return np.ascontiguousarray(pixels).reshape(self.height, self.width)
+
+
+    def _frame(self, line_idx):
         """
-        # build image
-        axis_frames = []
-        for line_idx in range(self.height):
+        Generate a frame (i.e. line) with specific tuser settings from the pixel array.
 
-            # Set tuser to 1 for the first pixel in first line only
-            tuser = [1 if line_idx == 0 else 0] + [0] * (self.width - 1)
+        :param line_idx: Index of the line
+        :return: AxiStreamFrame object representing the line
+        """
+        # Set tuser to 1 for the first pixel in first line only
+        tuser = [1 if line_idx == 0 else 0] + [0] * (self.width - 1)
+
+        # tolist() yields Python ints (avoids NumPy scalars being handed to the AXI stream source)
+        return AxiStreamFrame(tdata=np.asarray(self.pixels[line_idx]).tolist(), tuser=tuser)
 
-            # Create frame for the line
-            line = AxiStreamFrame(tdata=data[line_idx*self.width:(line_idx+1)*self.width], tuser=tuser)
 
-            axis_frames.append(line)
+    @property
+    def axis_frames(self):
+        """
+        List of AxiStreamFrame objects representing the image. Array backed images materialize all lines once
+        and are backed by this list from then on, so changes to it are kept like for images built from frames
 
-        return axis_frames
+        :return: List of AxiStreamFrame objects
+        """
+        if self._axis_frames is None:
+            self._axis_frames = [self._frame(line_idx) for line_idx in range(self.height)]
+            self.pixels = None
+        return self._axis_frames
 
 
     async def send(self, axis_source):
@@ -82,7 +117,7 @@ class AxiStreamImage:
 
         :param axis_source: The AXI stream source to send data through
         """
-        for line in self.axis_frames:
+        for line in self:
             await axis_source.send(line)
 
 
@@ -92,26 +127,52 @@ class AxiStreamImage:
 
         :return: A list of all pixel values
         """
-        return sum([af.tdata for af in self.axis_frames], [])
+        if self.pixels is not None:
+            return np.asarray(self.pixels).ravel().tolist()
+        return list(itertools.chain.from_iterable(af.tdata for af in self._axis_frames))
+
+
+    def flat(self):
+        """
+        Get all individual pixel values as a read-only 1D NumPy array
+
+        For array backed images this is a zero-copy view on the pixel array.
+        Images built from frames are converted once in linear time
+
+        :return: read-only 1D NumPy array of all pixel values
+        """
+        if self.pixels is not None:
+            view = np.asarray(self.pixels).reshape(-1)
+        else:
+            data = self.data()
+            view = np.array(data, dtype=utility.fitted_dtype(max(data, default=0).bit_length()))
+        view.flags.writeable = False
+        return view
 
 
     def __eq__(self, other):
-        if len(self.axis_frames) != len(other.axis_frames):
+        if self.pixels is not None and other.pixels is not None:
+            return np.array_equal(np.asarray(self.pixels), np.asarray(other.pixels))
+        if len(self) != len(other) or self.height != other.height:
             return False
-        return all(frame_lhs == frame_rhs for frame_lhs, frame_rhs in zip(self.axis_frames, other))
+        return all(frame_lhs == frame_rhs for frame_lhs, frame_rhs in zip(self, other))
 
 
     def __repr__(self):
-        frames = '\n'.join(f"line {idx}: "+repr(frame) for idx,frame in enumerate(self.axis_frames))
+        frames = '\n'.join(f"line {idx}: "+repr(frame) for idx,frame in enumerate(self))
         return f"{'*' * 18} [{self.__class__.__name__}] {'*' * 18}\n{frames}\n{'*' * 18} {'*' * 16} {'*' * 18}\n"
 
 
     def __len__(self):
-        return sum(len(frame) for frame in self.axis_frames)
+        if self.pixels is not None:
+            return self.width*self.height
+        return sum(len(frame) for frame in self._axis_frames)
 
 
     def __iter__(self):
-        return iter(self.axis_frames)
+        if self._axis_frames is not None:
+            return iter(self._axis_frames)
+        return (self._frame(line_idx) for line_idx in range(self.height))
 
 
     def __getitem__(self, index):
@@ -119,22 +180,25 @@ class AxiStreamImage:
             raise TypeError("Index must be an integer")
 
         if index < 0:
-            index += len(self.axis_frames)  # Handle negative indexing
+            index += self.height  # Handle negative indexing
 
-        if index >= len(self.axis_frames) or index < 0:
+        if index >= self.height or index < 0:
             raise IndexError("Index out of range")
 
-        return self.axis_frames[index]
+        if self._axis_frames is not None:
+            return self._axis_frames[index]
+        return self._frame(index)
 
 
     def __setitem__(self, index, value):
         if not isinstance(index, int):
             raise TypeError("Index must be an integer")
-        
+
         if index < 0:
-            index += len(self.axis_frames) + 1  # +1 because we extend if index is out of range
+            index += self.height + 1  # +1 because we extend if index is out of range
 
-        if index >= len(self.axis_frames):
+        if index >= self.height:
             raise IndexError("Index out of range")
 
-        self.axis_frames[index] = value
\ No newline at end of file
+        # Replacing a single frame may change its tuser, fall back to list of frames
+        self.axis_frames[index] = value
@@ -0,0 +1,134 @@
+import itertools
+import re
+import cocotb
+import pause_patterns
+
+# Axes of the generated run_axi_stream tests. Every combination of the axes is one test named
+# run_axi_stream_<n_frames>_frame(s)_<size>[_<pause profile>], e.g. run_axi_stream_3_frames_20x10_random_tready.
+# A value added to an axis adds all its combinations, no test function has to be written
+#
+# number of frames (i.e. images) sent back-to-back
+FRAMES = [1, 3, 30]
+# image sizes read from images/RGBRandom_<size>_<bits>bit.pnm
+IMAGE_SIZES = ["4x3", "20x10"]
+# image sizes generated with GENERATED_PATTERN instead of read from a file, see image_generator
+GENERATED_SIZES = ["640x480", "1920x1080"]
+GENERATED_PATTERN = "random"
+# pause profiles of tvalid and tready (see pause_patterns.PROFILES). name -> (tvalid profile, tready profile)
+# e.g. "bursty_tready": (None, "bursty") adds long backpressure stalls
+PAUSES = {
+    "": (None, None),
+    "random_tvalid": ("random", None),
+    "random_tready": (None, "random"),
+    "random_tvalid_random_tready": ("random", "random"),
+}
+
+# tests with a higher cost are skipped unless they are selected by name (TESTCASE or the runner)
+MAX_COST = 10_000
+
+
+def points():
+    """
+    All combinations of the axes in declaration order
+
+    :return: list of dicts with the keys n_frames, size, pattern and pause
+    """
+    return [
+        {"n_frames": n_frames, "size": size, "pattern": None if size in IMAGE_SIZES else GENERATED_PATTERN, "pause": pause}
+        for size, n_frames, pause in itertools.product(IMAGE_SIZES + GENERATED_SIZES, FRAMES, PAUSES)
+    ]
+
+
+def name(point):
+    frames = f"{point['n_frames']}_frame" + ("s" if point["n_frames"] > 1 else "")
+    return "_".join(filter(None, ["run_axi_stream", frames, point["size"], point["pause"]]))
+
+
+def test_name(point):
+    # name of the generated cocotb test as cocotb reports it and accepts it as testcase. on cocotb 2.x the combination
+    # is the value of the parametrize option "point" of run_axi_stream or run_axi_stream_large
+    if not hasattr(cocotb, "parametrize"):
+        return name(point)
+    group = "run_axi_stream_large" if cost(point) > MAX_COST else "run_axi_stream"
+    return f"{group}/point={name(point)}"
+
+
+def cost(point):
+    # estimated clock cycles at one pixel per clock. every paused handshake slows down by its pause duty cycle
+    width, height = map(int, point["size"].split("x"))
+    tvalid, tready = PAUSES[point["pause"]]
+    return point["n_frames"] * width * height * pause_patterns.slowdown(tvalid) * pause_patterns.slowdown(tready)
+
+
+def compatible(point, pixel_per_clock):
+    # a line has to be a whole number of beats
+    return int(point["size"].split("x")[0]) % pixel_per_clock == 0
+
+
+def select(pattern = None, max_cost = None, pixel_per_clock = 1, order = "declared"):
+    """
+    Names of the generated tests to run, e.g. as testcase of the runner
+
+    :param pattern: (optional) regular expression searched in the test names, e.g. "4x3" or "3_frames.*tready"
+    :param max_cost: (optional) only tests with an estimated cost up to this
+    :param pixel_per_clock: G_PIXEL_PER_CLOCK. only sizes that are compatible with it
+    :param order: "declared", "cheapest" (cheap subsets first) or "costliest"
+    :return: list of test names, see test_name()
+    """
+    selected = [
+        point for point in points()
+        if (pattern is None or re.search(pattern, name(point)))
+        and (max_cost is None or cost(point) <= max_cost)
+        and compatible(point, pixel_per_clock)
+    ]
+    if order not in ("declared", "cheapest", "costliest"):
+        raise ValueError(f"Unknown test order '{order}'. Use 'declared', 'cheapest' or 'costliest'")
+    if order != "declared":
+        selected.sort(key = cost, reverse = order == "costliest")
+    return [test_name(point) for point in selected]
+
+
+def generate(namespace, test_func):
+    """
+    Generates one cocotb test per combination of the axes into the namespace of the test module, like TestFactory
+    but with descriptive names that stay the same when axes grow. Tests above MAX_COST are generated with skip=True.
+
+    On cocotb 2.x the combinations are the values of the cocotb.parametrize option "point" of two tests,
+    run_axi_stream and run_axi_stream_large. The values are the cocotb 1.x names, see test_name()
+
+    :param namespace: globals() of the test module
+    :param test_func: async function (dut, n_frames, size, pattern, pause) running one combination
+    """
+    if hasattr(cocotb, "parametrize"):
+        by_name = {name(point): point for point in points()}
+        for group, large in (("run_axi_stream", False), ("run_axi_stream_large", True)):
+            async def test(dut, point):
+                await test_func(dut, **by_name[point])
+            test.__name__ = test.__qualname__ = group
+            names = [name(point) for point in points() if (cost(point) > MAX_COST) == large]
+            namespace[group] = cocotb.test(skip = large)(cocotb.parametrize(point = names)(test))
+        check(namespace)
+        return
+
+    for point in points():
+        # binds the combination to its own test function
+        def make_test(point):
+            async def test(dut):
+                await test_func(dut, **point)
+            return test
+        test = make_test(point)
+        test.__name__ = test.__qualname__ = name(point)
+        test.__module__ = namespace["__name__"]
+        namespace[name(point)] = cocotb.test(skip = cost(point) > MAX_COST)(test)
+    check(namespace)
+
+
+def check(namespace):
+    """
+    Raises if a test name returned by select() does not exist in the test module, e.g. after a naming change
+
+    :param namespace: globals() of the test module after generate()
+    """
+    missing = [test for test in select() if test.split("/")[0] not in namespace]
+    if missing:
+        raise RuntimeError(f"Generated tests {missing} not found in test module {namespace['__name__']}")
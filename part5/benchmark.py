@@ -0,0 +1,387 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import itertools
+import random
+import json
+import xml.etree.ElementTree as ET
+from pathlib import Path
+import numpy as np
+from cocotbext.axi import AxiStreamFrame
+from AxiStreamImage import AxiStreamImage
+import pause_patterns
+import pixel_packing
+import reference_model
+import utility
+
+# Image sizes (width, height) used by the benchmarks
+SIZES = [(20, 10), (640, 480), (1920, 1080), (3840, 2160)]
+
+# The quadratic legacy implementations are only run up to this many lines
+LEGACY_MAX_HEIGHT = 480
+
+# Simulators compared by bench_simulators()
+SIMULATORS = ["ghdl", "nvc"]
+
+# Clock period of the DUT clock, see test_axis_design.CLK_PERIOD_NS
+CLK_PERIOD_NS = 5
+
+# Sweep of bench_throughput(). every combination is one simulation of test_axis_design.run_axi_stream_benchmark.
+# large sizes are selected with e.g. BENCHMARK_SIZES=640x480,1920x1080. a 3840x2160 point simulates 8M cycles and more
+THROUGHPUT_SIZES = os.getenv("BENCHMARK_SIZES", "20x10,640x480").split(",")
+THROUGHPUT_PIXEL_PER_CLOCK = [1, 4]
+THROUGHPUT_DATA_WIDTH = [8, 16]
+THROUGHPUT_HANDSHAKE = ["none", "tvalid_tready"]
+
+# Stored throughput per sweep point. throughput depends on the machine, so the baseline is not part of the repository:
+# points missing in it (e.g. all of them on the first run) are added from the current run.
+# BENCHMARK_UPDATE_BASELINE=True overwrites all points
+THROUGHPUT_BASELINE = Path(__file__).resolve().parent / "benchmark_baseline.json"
+# Allowed throughput drop against the baseline
+THROUGHPUT_TOLERANCE = float(os.getenv("BENCHMARK_TOLERANCE", "0.2"))
+
+
+def timed(func, *args):
+    # Wall time in seconds of a single call
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def random_pixels(width, height, bit_width=24, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 2**bit_width, size=width*height, dtype=np.uint64).astype(utility.fitted_dtype(bit_width))
+
+
+def bench_data():
+    """
+    AxiStreamImage.data() and flat() against the old sum() based concatenation
+    """
+    print(f"{'size':>12} {'legacy sum() [s]':>18} {'data() frames [s]':>18} {'data() array [s]':>18} {'flat() [s]':>12}")
+    for width, height in SIZES:
+        pixels = random_pixels(width, height)
+        image = AxiStreamImage(pixels, width, height)
+        rx_image = AxiStreamImage.from_frames([AxiStreamFrame(tdata=line.tolist()) for line in image.pixels])
+
+        if height <= LEGACY_MAX_HEIGHT:
+            legacy = f"{timed(lambda: sum([af.tdata for af in rx_image.axis_frames], [])):18.4f}"
+        else:
+            legacy = f"{'skipped':>18}"
+
+        print(f"{f'{width}x{height}':>12} {legacy} {timed(rx_image.data):18.4f} {timed(image.data):18.4f} {timed(image.flat):12.6f}")
+
+
+def legacy_pack(tx_data, pixel_per_clock, bit_shift):
+    # send() packing loop before pixel_packing (PPC 1, 2, 4 only)
+    if pixel_per_clock == 1:
+        return tx_data
+    if pixel_per_clock == 2:
+        return [(tx_data[i+1] << (1 * bit_shift) |
+                 tx_data[i]) for i in range(0, len(tx_data), 2)]
+    return [(tx_data[i+3] << (3 * bit_shift) |
+             tx_data[i+2] << (2 * bit_shift) |
+             tx_data[i+1] << (1 * bit_shift) |
+             tx_data[i]) for i in range(0, len(tx_data), 4)]
+
+
+def legacy_unpack(rx_tdata, pixel_per_clock, bit_shift):
+    # recv() slicing loop before pixel_packing (PPC 1, 2, 4 only)
+    bit_mask = 2**bit_shift-1
+    result_tdata = []
+    for num in rx_tdata:
+        result_tdata.extend([(num >> (idx * bit_shift)) & bit_mask for idx in range(pixel_per_clock)])
+    return result_tdata
+
+
+def bench_packing():
+    """
+    pixel_packing.pack()/unpack() against the old send()/recv() loops. Results are checked to be bit exact
+    """
+    n_color_components = 3
+    print(f"{'size':>12} {'PPC':>4} {'width':>6} {'legacy pack [s]':>16} {'pack [s]':>10} {'legacy unpack [s]':>18} {'unpack [s]':>11}")
+    for width, height in SIZES[2:]:
+        for data_width in [8, 16]:
+            for pixel_per_clock in [1, 2, 4]:
+                bit_shift = data_width*n_color_components
+                pixels = random_pixels(width, height, bit_shift).astype(np.uint64)
+                tx_data = pixels.tolist()
+
+                start = time.perf_counter()
+                legacy_beats = legacy_pack(tx_data, pixel_per_clock, bit_shift)
+                t_legacy_pack = time.perf_counter() - start
+                start = time.perf_counter()
+                beats = pixel_packing.pack(pixels.reshape(height, width), pixel_per_clock, bit_shift).ravel()
+                t_pack = time.perf_counter() - start
+                assert beats.tolist() == legacy_beats, "pack() is not bit exact"
+
+                start = time.perf_counter()
+                legacy_pixels = legacy_unpack(legacy_beats, pixel_per_clock, bit_shift)
+                t_legacy_unpack = time.perf_counter() - start
+                start = time.perf_counter()
+                unpacked = pixel_packing.unpack(legacy_beats, pixel_per_clock, bit_shift)
+                t_unpack = time.perf_counter() - start
+                assert unpacked.tolist() == legacy_pixels == tx_data, "unpack() is not bit exact"
+
+                print(f"{f'{width}x{height}':>12} {pixel_per_clock:>4} {pixel_per_clock*bit_shift:>6} {t_legacy_pack:16.4f} {t_pack:10.4f} {t_legacy_unpack:18.4f} {t_unpack:11.4f}")
+
+
+def legacy_coco(tx_data, width, height):
+    # coco() golden model loop before reference_model (one image)
+    coco_frames = []
+    for line in range(height):
+        coco_pixels = []
+        for pixel in range(width):
+            coco_pixels.append(tx_data[line*width+pixel] + 1)
+        tuser = [1 if line == 0 else 0] + [0] * (width - 1)
+        coco_frames.append(AxiStreamFrame(tdata=coco_pixels, tuser=tuser))
+    return AxiStreamImage.from_frames(coco_frames)
+
+
+def bench_coco():
+    """
+    reference_model kernels against the old nested loop golden model
+    """
+    data_width = 8
+    n_color_components = 3
+    kernels = {
+        "increment": {},
+        "gain": {"gains": [0.5, 1.0, 1.5]},
+        "lut": {"table": np.arange(2**data_width)[::-1]},
+        "filter3x3": {"coefficients": [1, 2, 1, 2, 4, 2, 1, 2, 1], "shift": 4},
+    }
+    print(f"{'size':>12} {'legacy loop [s]':>16} " + " ".join(f"{name+' [s]':>16}" for name in kernels))
+    for width, height in SIZES:
+        pixels = random_pixels(width, height, data_width*n_color_components)
+        tx_data = pixels.tolist()
+
+        start = time.perf_counter()
+        legacy_image = legacy_coco(tx_data, width, height)
+        t_legacy = time.perf_counter() - start
+
+        timings = []
+        for name, params in kernels.items():
+            start = time.perf_counter()
+            result = reference_model.apply(name, pixels.reshape(height, width), data_width, n_color_components, **params)
+            timings.append(time.perf_counter() - start)
+            if name == "increment":
+                # legacy loop does not wrap around at the pixel width
+                assert result.ravel().tolist() == [value & (2**24-1) for value in legacy_image.data()], "increment kernel is not bit exact"
+
+        print(f"{f'{width}x{height}':>12} {t_legacy:16.4f} " + " ".join(f"{t:16.4f}" for t in timings))
+
+
+def legacy_read_pnm(file_path):
+    # P3 read_pnm() before the bulk decode. one pixel per line, combined with shifts
+    with open(file_path, 'rb') as f:
+        f.readline()
+        width, height = map(int, f.readline().decode().split())
+        max_value = int(f.readline().decode())
+        bit_depth = utility.power_of_two(max_value)
+        data = []
+        for line in f:
+            values = [int(x) for x in line.decode().split()]
+            data.append((values[0] << (2*bit_depth)) | (values[1] << bit_depth) | values[2])
+        return (data, width, height, max_value)
+
+
+def legacy_write_pnm(data, width, height, max_value, file_path):
+    # P3 write_pnm() before the bulk encode. one write call per color component
+    bit_depth = utility.power_of_two(max_value)
+    _data = []
+    for value in data:
+        _data.append(value >> (2*bit_depth))
+        _data.append(value >> bit_depth & max_value)
+        _data.append(value & max_value)
+    with open(file_path, 'w') as f:
+        f.write(f"P3\n{width} {height}\n{max_value}\n")
+        for idx,value in enumerate(_data, 1):
+            f.write(f"{value} ")
+            if idx % 3 == 0:
+                f.write("\n")
+
+
+def bench_pnm():
+    """
+    utility.read_pnm_array()/write_pnm() against the old per line/per value implementations. P3 output is checked to be bit exact
+    """
+    n_color_components = 3
+    print(f"{'size':>12} {'bits':>5} {'legacy read [s]':>16} {'read P3 [s]':>12} {'read P6 [s]':>12} {'legacy write [s]':>17} {'write P3 [s]':>13} {'write P6 [s]':>13}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_path, p3_path, p6_path = (os.path.join(tmp_dir, name) for name in ["legacy.pnm", "p3.pnm", "p6.pnm"])
+        for width, height in SIZES[1:]:
+            for data_width in [8, 16]:
+                max_value = 2**data_width-1
+                data = random_pixels(width, height, data_width*n_color_components)
+
+                t_legacy_write = timed(legacy_write_pnm, data.tolist(), width, height, max_value, legacy_path)
+                t_write_p3 = timed(utility.write_pnm, data, width, height, max_value, p3_path, 'P3')
+                t_write_p6 = timed(utility.write_pnm, data, width, height, max_value, p6_path, 'P6')
+                with open(legacy_path, 'rb') as f_legacy, open(p3_path, 'rb') as f_p3:
+                    assert f_legacy.read() == f_p3.read(), "write_pnm() is not bit exact"
+
+                start = time.perf_counter()
+                legacy_data = legacy_read_pnm(legacy_path)[0]
+                t_legacy_read = time.perf_counter() - start
+                start = time.perf_counter()
+                p3_data = utility.read_pnm_array(p3_path)[0]
+                t_read_p3 = time.perf_counter() - start
+                t_read_p6 = timed(utility.read_pnm_array, p6_path)
+                assert p3_data.tolist() == legacy_data == utility.read_pnm(p6_path)[0], "read_pnm() is not bit exact"
+
+                print(f"{f'{width}x{height}':>12} {data_width:>5} {t_legacy_read:16.4f} {t_read_p3:12.4f} {t_read_p6:12.4f} {t_legacy_write:17.4f} {t_write_p3:13.4f} {t_write_p6:13.4f}")
+
+
+def legacy_pause_generator():
+    while True:
+        yield bool(random.getrandbits(1))
+
+
+def bench_pause():
+    """
+    Pregenerated pause patterns against the old per-cycle random.getrandbits() generator. 7 channels (AXI stream
+    source and sink, five AXI lite channels) are stepped once per cycle like cocotbext-axi does
+    """
+    n_cycles = 1920*1080
+    n_channels = 7
+    print(f"{'profile':>10} {'duty':>6} {'legacy [s]':>11} {'setup [s]':>10} {'iterate [s]':>12}")
+    for profile in pause_patterns.PROFILES:
+        legacy = [legacy_pause_generator() for _ in range(n_channels)]
+        start = time.perf_counter()
+        for generator in legacy:
+            for paused in itertools.islice(generator, n_cycles):
+                pass
+        t_legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        generators = [pause_patterns.pause_generator(profile, 0, f"channel{idx}") for idx in range(n_channels)]
+        t_setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for generator in generators:
+            for paused in itertools.islice(generator, n_cycles):
+                pass
+        t_iterate = time.perf_counter() - start
+        duty = np.mean([pause_patterns.pattern(seed=0, channel=f"channel{idx}", **pause_patterns.PROFILES[profile]).mean() for idx in range(n_channels)])
+
+        print(f"{profile:>10} {duty:6.3f} {t_legacy:11.4f} {t_setup:10.4f} {t_iterate:12.4f}")
+
+
+def bench_simulators():
+    """
+    Full part5 regression (TESTS=all python test_runner.py --parallel) per simulator, i.e. all AXI lite and
+    run_axi_stream tests. Reports wall time, simulated clock cycles per second and the peak RSS of the largest
+    simulator process
+    """
+    proj_path = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'simulator':>10} {'tests':>6} {'fail':>5} {'wall time [s]':>14} {'cycles':>12} {'cycles/s':>12} {'peak RSS [MB]':>14}")
+    for sim in SIMULATORS:
+        if shutil.which(sim) is None:
+            print(f"{sim:>10} {'skipped, not installed':>24}")
+            continue
+
+        # every test runs, cached passes of the incremental regression would distort the result.
+        # TESTS=all includes the AXI stream tests, the runner's default only runs the AXI lite tests
+        env = dict(os.environ, SIM=sim, INCREMENTAL="False", TESTS="all")
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "test_runner.py", "--parallel"], cwd=proj_path, env=env, stdout=subprocess.DEVNULL)
+        # rusage of the runner includes all simulator processes it waited for. ru_maxrss is in kB on Linux
+        _, _, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+
+        testcases = list(ET.parse(os.path.join(proj_path, "sim_run", "results.xml")).getroot().iter("testcase"))
+        n_failed = sum(testcase.find("failure") is not None for testcase in testcases)
+        cycles = sum(float(testcase.get("sim_time_ns", 0)) for testcase in testcases) / CLK_PERIOD_NS
+        print(f"{sim:>10} {len(testcases):>6} {n_failed:>5} {wall_time:14.2f} {cycles:12.0f} {cycles/wall_time:12.0f} {rusage.ru_maxrss/1024:14.1f}")
+
+
+def bench_throughput():
+    """
+    Simulation throughput in pixels per second of wall time through axis_design for THROUGHPUT_SIZES,
+    THROUGHPUT_PIXEL_PER_CLOCK, THROUGHPUT_DATA_WIDTH and THROUGHPUT_HANDSHAKE. Compared against THROUGHPUT_BASELINE
+
+    :return: False if a point failed or got slower than the baseline by more than THROUGHPUT_TOLERANCE
+    """
+    # imported here, the other benchmarks don't need the cocotb runner
+    import test_runner
+
+    sim = os.getenv("SIM", "ghdl")
+    proj_path = Path(__file__).resolve().parent
+    (proj_path / "sim_bench").mkdir(exist_ok=True)
+    baseline = json.loads(THROUGHPUT_BASELINE.read_text()) if THROUGHPUT_BASELINE.is_file() else {}
+    update_baseline = os.getenv("BENCHMARK_UPDATE_BASELINE", "False") == "True"
+
+    passed = True
+    new_points = []
+    print(f"{'point':>40} {'wall time [s]':>14} {'pixels/s':>12} {'baseline':>12} {'ratio':>6}")
+    for size, data_width, pixel_per_clock, handshake in itertools.product(THROUGHPUT_SIZES, THROUGHPUT_DATA_WIDTH, THROUGHPUT_PIXEL_PER_CLOCK, THROUGHPUT_HANDSHAKE):
+        width, height = map(int, size.split("x"))
+
+        # one point at a time. parallel simulations would distort the wall time
+        # runs in sim_bench, the results and durations of the regression in sim_run stay untouched
+        results_xml = test_runner.run(data_width, 3, pixel_per_clock, log_file=proj_path / "sim_bench" / "benchmark.log", shards=1, incremental=False,
+            tests=["run_axi_stream_benchmark"], run_dir=proj_path / "sim_bench",
+            env={
+                # random stimulus is generated in the simulation, no image files needed
+                "BENCHMARK_SIZE": size,
+                "BENCHMARK_PATTERN": "random",
+                "BENCHMARK_HANDSHAKE": handshake,
+                # memory stays bounded for large images
+                "STREAMING_SCOREBOARD": "True",
+            })
+
+        point = f"{sim}_{size}_{data_width}bit_ppc{pixel_per_clock}_{handshake}"
+        telemetry = json.loads((Path(results_xml).parent / "run_axi_stream_benchmark.telemetry.json").read_text())
+        n_failed = sum(testcase.find("failure") is not None for testcase in ET.parse(results_xml).getroot().iter("testcase"))
+        pixels_per_s = width*height / telemetry["wall_time_s"]
+
+        if n_failed:
+            passed = False
+            status = "FAILED"
+        elif point in baseline:
+            ratio = pixels_per_s / baseline[point]
+            status = f"{ratio:6.2f}" + (" SLOWER" if ratio < 1 - THROUGHPUT_TOLERANCE else "")
+            passed &= ratio >= 1 - THROUGHPUT_TOLERANCE
+        else:
+            status = f"{'new':>6}"
+        print(f"{point:>40} {telemetry['wall_time_s']:14.2f} {pixels_per_s:12.0f} {baseline.get(point, 0):12.0f} {status}")
+
+        if not n_failed and (update_baseline or point not in baseline):
+            new_points.append(point)
+            baseline[point] = pixels_per_s
+
+    if new_points:
+        THROUGHPUT_BASELINE.write_text(json.dumps(baseline, indent=4, sort_keys=True))
+        print(f"INFO: {len(new_points)} points written to the baseline {THROUGHPUT_BASELINE}. they are compared from the next run on")
+    return passed
+
+
+BENCHMARKS = {
+    "data": bench_data,
+    "packing": bench_packing,
+    "coco": bench_coco,
+    "pnm": bench_pnm,
+    "pause": bench_pause,
+    "simulators": bench_simulators,
+    "throughput": bench_throughput,
+}
+
+
+if __name__ == "__main__":
+
+    ## Runs all benchmarks
+    # python benchmark.py
+    ## Runs selected benchmarks only
+    # python benchmark.py data
+    ## Compares GHDL and nvc on the full regression
+    # python benchmark.py simulators
+    ## Simulation throughput sweep against the stored baseline (written by the first run). fails on a slowdown of more than 20%
+    # python benchmark.py throughput
+    ## Stores the measured throughput as new baseline
+    # BENCHMARK_UPDATE_BASELINE=True python benchmark.py throughput
+    passed = True
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"{'*' * 18} [{name}] {'*' * 18}")
+        passed &= BENCHMARKS[name]() is not False
+    sys.exit(0 if passed else 1)
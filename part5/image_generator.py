@@ -0,0 +1,117 @@
+import numpy as np
+import utility
+
+# Synthetic stimulus patterns. name -> pattern function
+#
+# A pattern function gets broadcastable index arrays of lines (n x 1 x 1), pixels (1 x width x 1) and color
+# components (1 x 1 x n_color_components) and returns the sample values of these positions. Every sample only
+# depends on its position and the seed, so any line can be generated on its own and in any order.
+PATTERNS = {}
+
+
+def register_pattern(name):
+    """
+    Decorator to register a stimulus pattern under a name
+
+    :param name: name of the pattern used in SyntheticImage
+    """
+    def decorator(func):
+        if name in PATTERNS:
+            raise ValueError(f"Stimulus pattern '{name}' is already registered")
+        PATTERNS[name] = func
+        return func
+    return decorator
+
+
+def _splitmix64(x):
+    # stateless 64-bit hash (SplitMix64 finalizer). wraps around like the C reference implementation
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+@register_pattern("random")
+def random(lines, pixels, components, width, height, data_width, seed):
+    # uniformly distributed samples. hash of the sample position and the seed
+    n_color_components = components.shape[-1]
+    index = ((lines.astype(np.uint64)*np.uint64(width) + pixels.astype(np.uint64))*np.uint64(n_color_components) + components.astype(np.uint64))
+    return _splitmix64(index ^ _splitmix64(np.array([seed], dtype=np.uint64))) >> np.uint64(64 - data_width)
+
+
+@register_pattern("gradient")
+def gradient(lines, pixels, components, width, height, data_width, seed):
+    # first component ramps left to right, second top to bottom, all others diagonally
+    max_value = 2**data_width - 1
+    horizontal = pixels * max_value // max(width-1, 1)
+    vertical = lines * max_value // max(height-1, 1)
+    diagonal = (pixels + lines) * max_value // max(width+height-2, 1)
+    return np.where(components == 0, horizontal, np.where(components == 1, vertical, diagonal))
+
+
+@register_pattern("checkerboard")
+def checkerboard(lines, pixels, components, width, height, data_width, seed, block=8):
+    # black and white squares of block x block pixels
+    return ((lines//block + pixels//block) % 2) * (2**data_width - 1) + 0*components
+
+
+@register_pattern("toggle")
+def toggle(lines, pixels, components, width, height, data_width, seed, run_length=1):
+    # worst case bit toggling: all bits flip every run_length pixels and from line to line.
+    # use run_length=G_PIXEL_PER_CLOCK to flip all bits of every beat
+    return ((lines + pixels//run_length) % 2) * (2**data_width - 1) + 0*components
+
+
+class SyntheticImage:
+
+    def __init__(self, pattern, width, height, data_width, n_color_components=3, seed=0, **params):
+        """
+        Generated image that is used like the pixel data of utility.read_pnm(), without a file.
+        Lines are generated when accessed, so large images (e.g. 3840x2160) cost no memory until they are used
+
+        :param pattern: name of the registered pattern
+        :param width: image width in pixels
+        :param height: image height in lines
+        :param data_width: bit width of one color component i.e. G_DATA_WIDTH
+        :param n_color_components: number of color components per pixel i.e. G_N_COLOR_COMPONENTS
+        :param seed: seed of random patterns. the same seed always gives the same image
+        :param params: pattern specific parameters
+        """
+        if pattern not in PATTERNS:
+            raise ValueError(f"Unknown stimulus pattern '{pattern}'. Registered patterns are {list(PATTERNS)}")
+        self.pattern = pattern
+        self.width = width
+        self.height = height
+        self.data_width = data_width
+        self.n_color_components = n_color_components
+        self.seed = seed
+        self.params = params
+        self.max_value = 2**data_width - 1
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def __len__(self):
+        # number of pixels, like the flattened data list of utility.read_pnm()
+        return self.height*self.width
+
+    def _generate(self, lines):
+        samples = PATTERNS[self.pattern](
+            np.asarray(lines).reshape(-1, 1, 1),
+            np.arange(self.width).reshape(1, -1, 1),
+            np.arange(self.n_color_components).reshape(1, 1, -1),
+            self.width, self.height, self.data_width, self.seed, **self.params
+        )
+        return utility.combine_components(np.broadcast_to(samples, (len(lines), self.width, self.n_color_components)), self.data_width)
+
+    def __getitem__(self, line_idx):
+        # one line of combined pixel values
+        if not -self.height <= line_idx < self.height:
+            raise IndexError(f"Line {line_idx} out of range for image height {self.height}")
+        return self._generate([line_idx % self.height])[0]
+
+    def __array__(self, dtype=None, copy=None):
+        # generates the whole image at once
+        pixels = self._generate(np.arange(self.height))
+        return pixels if dtype is None else pixels.astype(dtype)
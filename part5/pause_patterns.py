@@ -0,0 +1,122 @@
+import functools
+import itertools
+import zlib
+import numpy as np
+
+# Pause profiles used by the AXI stream and AXI lite pause generators. name -> parameters of pattern()
+#
+# duty: fraction of paused cycles
+# burst: mean number of consecutive paused cycles
+PROFILES = {
+    # independent coin flip every cycle. same statistics as bool(random.getrandbits(1))
+    "random": {"kind": "random", "duty": 0.5, "burst": 2},
+    # rare short stalls
+    "light": {"kind": "random", "duty": 0.1, "burst": 1.5},
+    # long stalls, e.g. a master waiting for memory
+    "bursty": {"kind": "random", "duty": 0.5, "burst": 32},
+    # mostly stalled
+    "heavy": {"kind": "random", "duty": 0.9, "burst": 16},
+    # maximal length 16-bit LFSR. deterministic, repeats every 65535 cycles
+    "lfsr": {"kind": "lfsr", "duty": 0.5, "burst": 1, "n_bits": 16},
+}
+
+# Number of cycles of random patterns before they repeat
+LENGTH = 2**16
+
+# Taps of maximal length LFSRs (Xilinx XAPP052). n_bits -> taps
+LFSR_TAPS = {
+    7: (7, 6),
+    9: (9, 5),
+    11: (11, 9),
+    15: (15, 14),
+    16: (16, 15, 13, 4),
+    20: (20, 17),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _lfsr_states(n_bits):
+    # all 2**n_bits-1 states of the LFSR starting at 1. computed once per width
+    taps = LFSR_TAPS[n_bits]
+    mask = 2**n_bits - 1
+    states = np.empty(mask, dtype=np.uint32)
+    state = 1
+    for idx in range(mask):
+        states[idx] = state
+        feedback = 0
+        for tap in taps:
+            feedback ^= state >> (tap-1)
+        state = ((state << 1) | (feedback & 1)) & mask
+    return states
+
+
+def _random_pattern(rng, duty, burst, length):
+    # alternating runs of running and paused cycles with geometrically distributed lengths
+    run = burst * (1-duty) / duty
+    if run < 1:
+        raise ValueError(f"duty {duty} needs bursts of at least {duty/(1-duty):.2f} cycles, got {burst}")
+    n_runs = int(2*length / (burst+run)) + 16
+    runs = np.empty(2*n_runs, dtype=np.int64)
+    runs[0::2] = rng.geometric(1/run, n_runs)
+    runs[1::2] = rng.geometric(1/burst, n_runs)
+    pattern = np.repeat(np.tile([False, True], n_runs), runs)
+    while len(pattern) < length:
+        pattern = np.concatenate([pattern, _random_pattern(rng, duty, burst, length)])
+    return pattern[:length]
+
+
+def _lfsr_pattern(rng, duty, burst, n_bits):
+    # paused while the LFSR state is below duty*2**n_bits, every state held for burst cycles.
+    # the seed only selects the start state
+    states = np.roll(_lfsr_states(n_bits), -int(rng.integers(2**n_bits - 1)))
+    return np.repeat(states < duty * 2**n_bits, int(burst))
+
+
+def pattern(kind="random", duty=0.5, burst=2, seed=0, channel="", length=LENGTH, n_bits=16):
+    """
+    Pause pattern generated at once as boolean array, True is a paused cycle. The same seed and channel
+    always give the same pattern, different channels with the same seed give independent patterns
+
+    :param kind: "random" (geometrically distributed run lengths) or "lfsr" (repeating LFSR sequence)
+    :param duty: fraction of paused cycles, 0 <= duty < 1
+    :param burst: mean number of consecutive paused cycles, at least 1. for "lfsr" every LFSR state is held for
+                  int(burst) cycles
+    :param seed: seed, e.g. drawn from the per test seeded random module
+    :param channel: name of the paused channel, e.g. "s_axis_video_tvalid"
+    :param length: number of cycles of "random" patterns
+    :param n_bits: width of the LFSR, see LFSR_TAPS
+    :return: numpy array of bool
+    """
+    if not 0 <= duty < 1:
+        raise ValueError(f"duty has to be in [0, 1), got {duty}")
+    if burst < 1:
+        raise ValueError(f"burst has to be at least 1 cycle, got {burst}")
+    if duty == 0:
+        return np.zeros(1, dtype=bool)
+    # independent stream per channel
+    rng = np.random.default_rng([seed, zlib.crc32(channel.encode())])
+    if kind == "random":
+        return _random_pattern(rng, duty, burst, length)
+    if kind == "lfsr":
+        return _lfsr_pattern(rng, duty, burst, n_bits)
+    raise ValueError(f"Unknown pause pattern kind '{kind}'. Use 'random' or 'lfsr'")
+
+
+def pause_generator(profile, seed=0, channel=""):
+    """
+    Endless pause generator for set_pause_generator() of cocotbext-axi. The pattern is generated once and repeated,
+    so every cycle only costs one step of a C iterator
+
+    :param profile: name of the profile, see PROFILES
+    :param seed: seed, see pattern()
+    :param channel: name of the paused channel, see pattern()
+    :return: iterator of bool
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown pause profile '{profile}'. Available profiles are {list(PROFILES)}")
+    return itertools.cycle(pattern(seed=seed, channel=channel, **PROFILES[profile]).tolist())
+
+
+def slowdown(profile):
+    # throughput factor of a channel paused with this profile
+    return 1 / (1 - PROFILES[profile]["duty"]) if profile else 1
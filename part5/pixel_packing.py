@@ -0,0 +1,143 @@
+import itertools
+import numpy as np
+import utility
+
+# Beats are assembled from 64-bit limbs so any G_PIXEL_PER_CLOCK*G_N_COLOR_COMPONENTS*G_DATA_WIDTH can be handled
+LIMB_WIDTH = 64
+
+
+def n_limbs(beat_width):
+    return -(-beat_width // LIMB_WIDTH)
+
+
+def pack(pixels, pixel_per_clock, pixel_width):
+    """
+    Pack pixel_per_clock consecutive pixels into one AXI stream beat. Pixel 0 is put into the LSBs of a beat,
+    pixel 1 into the next bits and so on. Works on a single line or on a whole (height x width) image at once
+
+    :param pixels: pixel values along the last axis. list or NumPy array
+    :param pixel_per_clock: number of pixels per beat i.e. G_PIXEL_PER_CLOCK
+    :param pixel_width: bit width of one pixel i.e. G_DATA_WIDTH*G_N_COLOR_COMPONENTS
+    :return: NumPy array of beats. unsigned dtype for beats up to 64 bits, Python ints (object dtype) otherwise
+    """
+    pixels = np.asarray(pixels, dtype=np.uint64)
+    if pixels.shape[-1] % pixel_per_clock:
+        raise ValueError(f"Number of pixels ({pixels.shape[-1]}) is not a multiple of pixel per clock ({pixel_per_clock})")
+
+    beat_width = pixel_per_clock*pixel_width
+    groups = pixels.reshape(pixels.shape[:-1] + (-1, pixel_per_clock))
+    if pixel_per_clock == 2 and n_limbs(beat_width) == 2:
+        # two wide pixels are combined right away, no limbs needed
+        return _combine(groups, pixel_width)
+    limbs = np.zeros(groups.shape[:-1] + (n_limbs(beat_width),), dtype=np.uint64)
+    for idx in range(pixel_per_clock):
+        limb, shift = divmod(idx*pixel_width, LIMB_WIDTH)
+        limbs[..., limb] |= groups[..., idx] << np.uint64(shift)
+        # pixel crosses a limb boundary
+        if shift + pixel_width > LIMB_WIDTH:
+            limbs[..., limb+1] |= groups[..., idx] >> np.uint64(LIMB_WIDTH - shift)
+
+    if limbs.shape[-1] == 1:
+        return limbs[..., 0].astype(utility.fitted_dtype(beat_width))
+    if limbs.shape[-1] == 2:
+        return _combine(limbs, LIMB_WIDTH)
+    return _from_limbs(limbs)
+
+
+def unpack(beats, pixel_per_clock, pixel_width):
+    """
+    Slice AXI stream beats into pixel_per_clock single pixels each. Inverse of pack()
+
+    :param beats: beat values along the last axis. list or NumPy array
+    :param pixel_per_clock: number of pixels per beat i.e. G_PIXEL_PER_CLOCK
+    :param pixel_width: bit width of one pixel i.e. G_DATA_WIDTH*G_N_COLOR_COMPONENTS
+    :return: NumPy array of pixels with the smallest fitting unsigned dtype
+    """
+    beat_width = pixel_per_clock*pixel_width
+    if n_limbs(beat_width) == 1:
+        limbs = np.asarray(beats).astype(np.uint64)[..., None]
+    else:
+        limbs = _to_limbs(beats, n_limbs(beat_width))
+
+    mask = np.uint64(2**pixel_width-1)
+    pixels = np.empty(limbs.shape[:-1] + (pixel_per_clock,), dtype=np.uint64)
+    for idx in range(pixel_per_clock):
+        limb, shift = divmod(idx*pixel_width, LIMB_WIDTH)
+        value = limbs[..., limb] >> np.uint64(shift)
+        # pixel crosses a limb boundary
+        if shift + pixel_width > LIMB_WIDTH:
+            value |= limbs[..., limb+1] << np.uint64(LIMB_WIDTH - shift)
+        pixels[..., idx] = value & mask
+
+    return pixels.reshape(pixels.shape[:-2] + (-1,)).astype(utility.fitted_dtype(pixel_width))
+
+
+def unpack_tuser(tuser, pixel_per_clock):
+    """
+    Expand the tuser value of every beat to pixel level. The beat value belongs to its first pixel, all others are 0
+
+    :param tuser: tuser values of all beats
+    :param pixel_per_clock: number of pixels per beat i.e. G_PIXEL_PER_CLOCK
+    :return: list of tuser values, one per pixel
+    """
+    result = np.zeros((len(tuser), pixel_per_clock), dtype=np.uint8)
+    result[:, 0] = tuser
+    return result.ravel().tolist()
+
+
+class PackedLines:
+
+    def __init__(self, pixels, pixel_per_clock, pixel_width):
+        """
+        Lazily packed view on a (height x width) line source, e.g. utility.MappedPnm. Lines are packed when accessed
+
+        :param pixels: line source. indexing with a line index returns the pixels of that line
+        :param pixel_per_clock: number of pixels per beat i.e. G_PIXEL_PER_CLOCK
+        :param pixel_width: bit width of one pixel i.e. G_DATA_WIDTH*G_N_COLOR_COMPONENTS
+        """
+        self.pixels = pixels
+        self.pixel_per_clock = pixel_per_clock
+        self.pixel_width = pixel_width
+        height, width = pixels.shape
+        if width % pixel_per_clock:
+            raise ValueError(f"Number of pixels ({width}) is not a multiple of pixel per clock ({pixel_per_clock})")
+        self.shape = (height, width//pixel_per_clock)
+
+    def __len__(self):
+        # number of beats
+        return self.shape[0]*self.shape[1]
+
+    def __getitem__(self, line_idx):
+        return pack(self.pixels[line_idx], self.pixel_per_clock, self.pixel_width)
+
+    def __array__(self, dtype=None, copy=None):
+        beats = pack(np.asarray(self.pixels), self.pixel_per_clock, self.pixel_width)
+        return beats if dtype is None else beats.astype(dtype)
+
+
+def _combine(parts, part_width):
+    # Combine two little endian parts (pixels or 64-bit limbs) into Python ints (one per beat) with one vectorized
+    # object shift and OR. the low part is converted inside the OR, no intermediate object array
+    beats = parts[..., 1].astype(object)
+    np.left_shift(beats, part_width, out=beats)
+    np.bitwise_or(beats, parts[..., 0], out=beats, dtype=object)
+    return beats
+
+
+def _from_limbs(limbs):
+    # Combine 3 or more 64-bit limbs into Python ints (one per beat). one int.from_bytes() per beat is cheaper
+    # than a shift and OR per limb
+    n_bytes = limbs.shape[-1]*(LIMB_WIDTH//8)
+    raw = np.ascontiguousarray(limbs[..., ::-1], dtype='>u8').view(f'V{n_bytes}')
+    beats = np.empty(raw.size, dtype=object)
+    beats[:] = list(map(int.from_bytes, raw.ravel().tolist(), itertools.repeat('big')))
+    return beats.reshape(limbs.shape[:-1])
+
+
+def _to_limbs(beats, count):
+    # Split Python int beats into 64-bit limbs
+    beats = np.asarray(beats, dtype=object)
+    limbs = np.empty(beats.shape + (count,), dtype=np.uint64)
+    for limb in range(count):
+        limbs[..., limb] = (beats >> (limb*LIMB_WIDTH)) & (2**LIMB_WIDTH-1)
+    return limbs
@@ -0,0 +1,245 @@
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import warnings
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import utility
+
+# Registered reference kernels. name -> kernel function
+#
+# A kernel gets the whole image as (height x width) array of pixel values and returns the expected
+# output image of the same shape. Pixels hold n_color_components components of data_width bits each,
+# the first component (e.g. R) in the MSBs like utility.read_pnm() combines them.
+KERNELS = {}
+
+# Version tag of every registered kernel. name -> version. part of the OutputCache key
+KERNEL_VERSIONS = {}
+
+# Kernels whose results are taken from an OutputCache. name -> bool. hashing the input costs about as much as
+# a cheap kernel (e.g. increment), so only expensive kernels are cached
+KERNEL_CACHEABLE = {}
+
+
+def register_kernel(name, version=1, cacheable=False):
+    """
+    Decorator to register a reference kernel under a name
+
+    :param name: name of the kernel used in apply()
+    :param version: version tag of the kernel. increase it whenever the kernel's results change,
+                    cached results of older versions are not used then
+    :param cacheable: results are taken from the OutputCache passed to submit(). only worth it for kernels that
+                      cost more than hashing their input
+    """
+    def decorator(func):
+        if name in KERNELS:
+            raise ValueError(f"Reference kernel '{name}' is already registered")
+        KERNELS[name] = func
+        KERNEL_VERSIONS[name] = version
+        KERNEL_CACHEABLE[name] = cacheable
+        return func
+    return decorator
+
+
+def apply(name, pixels, data_width, n_color_components, **params):
+    """
+    Apply a registered kernel to a whole image
+
+    :param name: name of the registered kernel
+    :param pixels: (height x width) array of pixel values
+    :param data_width: bit width of one color component i.e. G_DATA_WIDTH
+    :param n_color_components: number of color components per pixel i.e. G_N_COLOR_COMPONENTS
+    :param params: kernel specific parameters
+    :return: (height x width) array of expected pixel values
+    """
+    if name not in KERNELS:
+        raise ValueError(f"Unknown reference kernel '{name}'. Registered kernels are {list(KERNELS)}")
+    return KERNELS[name](np.asarray(pixels, dtype=np.uint64), data_width, n_color_components, **params)
+
+
+class OutputCache:
+
+    def __init__(self, directory, max_bytes):
+        """
+        On-disk cache of kernel results keyed by kernel, kernel version, input pixels, generics and kernel parameters.
+        Least recently used results are evicted once the cache grows beyond max_bytes. Can be shared by parallel processes
+
+        :param directory: cache directory
+        :param max_bytes: maximum total size of all cached results
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def key(self, name, pixels, data_width, n_color_components, params):
+        """
+        :return: hex digest or None if the input cannot be cached (pixels wider than 64 bits)
+        """
+        pixels = np.asarray(pixels)
+        if pixels.dtype == object:
+            return None
+        sha = hashlib.sha256()
+        sha.update(json.dumps([name, KERNEL_VERSIONS.get(name), data_width, n_color_components, pixels.shape]).encode())
+        sha.update(np.ascontiguousarray(pixels, dtype=np.uint64).tobytes())
+        for param, value in sorted(params.items()):
+            value = np.asarray(value)
+            sha.update(f"{param}:{value.dtype}:{value.shape}".encode())
+            sha.update(value.tobytes())
+        return sha.hexdigest()
+
+    def get(self, key):
+        """
+        :return: cached result or None
+        """
+        cache_file = self.directory / f"{key}.npy"
+        try:
+            result = np.load(cache_file)
+        except (FileNotFoundError, ValueError, EOFError):
+            return None
+        # modification time is the time of last use for the LRU eviction
+        os.utime(cache_file)
+        return result
+
+    def put(self, key, result):
+        if result.dtype == object:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # written under a unique temporary name first, parallel processes and threads may read and write the same key
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix=f"{key}.", suffix=".tmp", delete=False) as f:
+            try:
+                np.save(f, result)
+            except BaseException:
+                f.close()
+                Path(f.name).unlink(missing_ok=True)
+                raise
+        Path(f.name).replace(self.directory / f"{key}.npy")
+        self.evict()
+
+    def evict(self):
+        files = []
+        for cache_file in self.directory.glob("*.npy"):
+            try:
+                files.append((cache_file.stat().st_mtime, cache_file.stat().st_size, cache_file))
+            except FileNotFoundError:
+                continue  # evicted by another process
+        total = sum(size for _, size, _ in files)
+        for _, size, cache_file in sorted(files):
+            if total <= self.max_bytes:
+                break
+            cache_file.unlink(missing_ok=True)
+            total -= size
+
+
+def cached_apply(cache, name, pixels, data_width, n_color_components, **params):
+    """
+    apply() that returns the result from an OutputCache if it was computed before
+
+    :param cache: OutputCache
+    :param name: name of the registered kernel
+    :param pixels: (height x width) array of pixel values
+    :param data_width: bit width of one color component i.e. G_DATA_WIDTH
+    :param n_color_components: number of color components per pixel i.e. G_N_COLOR_COMPONENTS
+    :param params: kernel specific parameters
+    :return: (height x width) array of expected pixel values
+    """
+    key = cache.key(name, pixels, data_width, n_color_components, params)
+    result = cache.get(key) if key else None
+    if result is None:
+        result = apply(name, pixels, data_width, n_color_components, **params)
+        if key:
+            cache.put(key, result)
+    return result
+
+
+# Worker pools for submit(). created on first use, shared by all tests of a simulation and shut down at exit
+_executors = {}
+
+
+@atexit.register
+def _shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown(cancel_futures=True)
+    _executors.clear()
+
+
+def _executor(kind):
+    if kind not in _executors:
+        if kind == "process":
+            # fork: the simulator process embeds Python, so there is no interpreter executable to spawn workers from.
+            # the forked workers inherit a copy of the simulator with its VPI/VHPI state and only hold the thread
+            # that forked. they must only run the kernels (NumPy on the arguments) and never call into cocotb
+            warnings.warn(
+                "COCO_EXECUTOR=process forks the simulator process. Workers only run reference kernels, "
+                "use 'thread' or 'inline' if the simulator or a kernel does not survive a fork",
+                RuntimeWarning,
+            )
+            _executors[kind] = ProcessPoolExecutor(mp_context=multiprocessing.get_context("fork"))
+        elif kind == "thread":
+            # only helps for kernels that release the GIL (i.e. NumPy heavy ones)
+            _executors[kind] = ThreadPoolExecutor()
+        else:
+            raise ValueError(f"Unknown executor '{kind}'. Use 'inline', 'thread' or 'process'")
+    return _executors[kind]
+
+
+def submit(kind, name, pixels, data_width, n_color_components, cache=None, **params):
+    """
+    Start apply() and return a concurrent.futures.Future of its result
+
+    :param kind: 'inline' computes right away, 'thread' or 'process' compute in a worker pool in parallel to the caller
+    :param name: name of the registered kernel
+    :param pixels: (height x width) array of pixel values
+    :param data_width: bit width of one color component i.e. G_DATA_WIDTH
+    :param n_color_components: number of color components per pixel i.e. G_N_COLOR_COMPONENTS
+    :param cache: (optional) OutputCache. results of cacheable kernels computed before are taken from it
+    :param params: kernel specific parameters
+    :return: Future of the (height x width) array of expected pixel values
+    """
+    func, args = (cached_apply, (cache,)) if cache is not None and KERNEL_CACHEABLE.get(name) else (apply, ())
+    if kind == "inline":
+        future = Future()
+        future.set_result(func(*args, name, pixels, data_width, n_color_components, **params))
+        return future
+    return _executor(kind).submit(func, *args, name, np.asarray(pixels), data_width, n_color_components, **params)
+
+
+@register_kernel("increment")
+def increment(pixels, data_width, n_color_components):
+    # simulation co-processing. implements the same operation as HW code: unsigned(tdata) + 1 per pixel
+    return (pixels + np.uint64(1)) & np.uint64(2**(data_width*n_color_components)-1)
+
+
+@register_kernel("gain")
+def gain(pixels, data_width, n_color_components, gains):
+    # per color component gain, saturated at the maximum component value
+    components = utility.split_components(pixels, n_color_components, data_width).astype(np.float64)
+    components = np.clip(np.rint(components * np.asarray(gains, dtype=np.float64)), 0, 2**data_width-1)
+    return utility.combine_components(components, data_width)
+
+
+@register_kernel("lut")
+def lut(pixels, data_width, n_color_components, table):
+    # look-up table applied to every color component. one table for all or one table per component
+    table = np.asarray(table, dtype=np.uint64)
+    components = utility.split_components(pixels, n_color_components, data_width)
+    if table.ndim == 1:
+        return utility.combine_components(table[components], data_width)
+    return utility.combine_components(table[np.arange(n_color_components), components], data_width)
+
+
+@register_kernel("filter3x3", cacheable=True)
+def filter3x3(pixels, data_width, n_color_components, coefficients, shift=0):
+    # 3x3 convolution per color component with replicated borders. result is shifted right and saturated
+    coefficients = np.asarray(coefficients, dtype=np.int64).reshape(3, 3)
+    components = utility.split_components(pixels, n_color_components, data_width).astype(np.int64)
+    padded = np.pad(components, ((1, 1), (1, 1), (0, 0)), mode='edge')
+    height, width = pixels.shape
+    result = np.zeros_like(components)
+    for row in range(3):
+        for col in range(3):
+            result += coefficients[row, col] * padded[row:row+height, col:col+width]
+    result = np.clip(result >> shift, 0, 2**data_width-1)
+    return utility.combine_components(result, data_width)
@@ -0,0 +1,529 @@
+import ast
+import fcntl
+import functools
+import hashlib
+import importlib.metadata
+import json
+import math
+import os
+import shutil
+import subprocess
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Simulators whose cocotb runner applies generics only when the design is elaborated and run in test()
+# (e.g. ghdl -r ... -gG_DATA_WIDTH=8). The analyzed library does not depend on the generics then
+RUNTIME_GENERICS_SIMS = ["ghdl", "nvc"]
+
+# Simulator specific command line arguments for VHDL 2008 and the waveform dump
+#   ghdl: the standard is needed for analysis (build_args) and elaboration/run (test_args)
+#   nvc: the standard is a global option. cocotb passes build_args in front of -a and -e, so no test_args are needed
+# wave_args are run time arguments, see wave_args() for a dump limited in time and signals
+SIM_ARGS = {
+    "ghdl": {
+        "build_args": ["--std=08"],
+        "test_args": ["--std=08"],
+        "wave_args": ["--fst=waveform.ghw"],
+    },
+    "nvc": {
+        "build_args": ["--std=2008"],
+        "test_args": [],
+        "wave_args": ["--wave=waveform.fst", "--format=fst"],
+    },
+}
+
+
+def sim_args(sim):
+    """
+    Command line arguments of a simulator, see SIM_ARGS
+
+    :param sim: simulator name
+    :return: dict with build_args, test_args and wave_args (run time arguments, passed as plusargs)
+    """
+    if sim not in SIM_ARGS:
+        raise ValueError(f"Unsupported simulator '{sim}'. Supported simulators are {list(SIM_ARGS)}")
+    return SIM_ARGS[sim]
+
+
+def work_args(sim, build_dir, library="top"):
+    """
+    Arguments that locate the analyzed library in build_dir. cocotb runs the tests in test_dir as working directory,
+    without them the simulator only looks for the library there
+      ghdl: --workdir is a run option (test_args). the LLVM and GCC backends run the executable linked by the build
+            instead, see link_executable()
+      nvc: --work is a global option. cocotb passes build_args in front of -e, a later --work overrides its --work=top
+
+    :param sim: simulator name
+    :param build_dir: build directory returned by cached_build()
+    :param library: name of the HDL library, hdl_toplevel_library of runner.test()
+    :return: dict with build_args and test_args to add for test()
+    """
+    build_dir = Path(build_dir).resolve()
+    if sim == "ghdl":
+        return {"build_args": [], "test_args": [f"--workdir={build_dir}"]}
+    if sim == "nvc":
+        return {"build_args": [f"--work={library}:{build_dir / library}"], "test_args": []}
+    raise ValueError(f"Unsupported simulator '{sim}'. Supported simulators are {list(SIM_ARGS)}")
+
+
+@functools.lru_cache(maxsize=None)
+def ghdl_mcode():
+    # GHDL with the mcode backend elaborates in memory when a test runs, the LLVM and GCC backends
+    # link an executable into the build directory. same check as the cocotb runner
+    result = subprocess.run(["ghdl", "--version"], check=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return "mcode" in result.stdout
+
+
+def link_executable(sim, build_dir, test_dir, hdl_toplevel):
+    """
+    ghdl -r of the LLVM and GCC backends runs the executable named after the toplevel in the working directory.
+    Links the executable of the cached build into test_dir, so every run keeps its own working directory.
+    Nothing to do for other simulators and GHDL mcode, they find the library by work_args()
+
+    :param sim: simulator name
+    :param build_dir: build directory returned by cached_build()
+    :param test_dir: working directory of the run
+    :param hdl_toplevel: name of the HDL toplevel
+    """
+    if sim != "ghdl" or ghdl_mcode():
+        return
+    executable = Path(test_dir) / hdl_toplevel.lower()
+    Path(test_dir).mkdir(parents=True, exist_ok=True)
+    executable.unlink(missing_ok=True)
+    executable.symlink_to(Path(build_dir).resolve() / hdl_toplevel.lower())
+
+
+def wave_args(sim, test_dir, signals=None, stop_time_ns=None):
+    """
+    Run time arguments for a waveform dump of selected signals that stops the simulation at a given time
+
+    :param sim: simulator name
+    :param test_dir: working directory of the run. GHDL reads the signal selection from a file written there
+    :param signals: (optional) hierarchical signal paths, e.g. "/axis_design/s_axis_*". "*" matches any name
+                    on one level, "**" any number of levels. None dumps all signals
+    :param stop_time_ns: (optional) simulation time to stop at. None runs until the end
+    :return: list of arguments, passed as plusargs
+    """
+    args = list(sim_args(sim)["wave_args"])
+    if signals:
+        if sim == "ghdl":
+            wave_opt = Path(test_dir) / "waveform.opt"
+            wave_opt.parent.mkdir(parents=True, exist_ok=True)
+            wave_opt.write_text("$ version 1.1\n" + "".join(f"{signal}\n" for signal in signals))
+            args.append(f"--read-wave-opt={wave_opt}")
+        else:
+            # nvc separates hierarchy levels by ':'
+            args += [f"--include={signal.replace('/', ':')}" for signal in signals]
+    if stop_time_ns is not None:
+        args.append(f"--stop-time={math.ceil(stop_time_ns)}ns")
+    return args
+
+
+def build_hash(sim, hdl_toplevel, vhdl_sources, parameters, build_args):
+    """
+    Content hash of everything a build depends on
+
+    :param sim: simulator name
+    :param hdl_toplevel: name of the HDL toplevel
+    :param vhdl_sources: VHDL source files. their content is hashed, not their modification time
+    :param parameters: generics applied at build time
+    :param build_args: simulator build arguments
+    :return: hex digest
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps({
+        "sim": sim,
+        "sim_executable": shutil.which(sim),
+        "hdl_toplevel": hdl_toplevel,
+        "parameters": {name: str(value) for name, value in sorted(parameters.items())},
+        "build_args": [str(arg) for arg in build_args],
+    }, sort_keys=True).encode())
+    _hash_files(sha, vhdl_sources)
+    return sha.hexdigest()
+
+
+def _hash_files(sha, files):
+    # directories (e.g. images/output of older test benches) are skipped
+    for file in sorted(Path(file).resolve() for file in files if Path(file).is_file()):
+        sha.update(str(file).encode())
+        sha.update(file.read_bytes())
+
+
+def build_parameters(sim, parameters):
+    """
+    Generics that have to be applied at build time. None for simulators in RUNTIME_GENERICS_SIMS,
+    so one analyzed library is shared by every generics combination
+
+    :param sim: simulator name
+    :param parameters: all generics
+    :return: generics for build()
+    """
+    return {} if sim in RUNTIME_GENERICS_SIMS else dict(parameters)
+
+
+def cached_build(runner, sim, build_root, hdl_toplevel, vhdl_sources, parameters, build_args):
+    """
+    Build into a directory named after the build_hash(). An existing build with the same hash is reused
+
+    :param runner: cocotb runner returned by get_runner()
+    :param sim: simulator name
+    :param build_root: directory containing all cached build directories
+    :param hdl_toplevel: name of the HDL toplevel
+    :param vhdl_sources: VHDL source files
+    :param parameters: generics applied at build time
+    :param build_args: simulator build arguments
+    :return: build directory to pass to runner.test()
+    """
+    key = build_hash(sim, hdl_toplevel, vhdl_sources, parameters, build_args)
+    build_dir = Path(build_root) / key[:16]
+    marker = build_dir / "build_hash.txt"
+
+    # parallel workers needing the same build wait for the first one instead of building into the same directory
+    Path(build_root).mkdir(parents=True, exist_ok=True)
+    with open(Path(build_root) / f"{key[:16]}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if marker.is_file() and marker.read_text() == key:
+            print(f"INFO: Reusing cached build {build_dir}")
+            # test() of some simulators (e.g. nvc) reads the build arguments set by build()
+            runner.build_args = list(build_args)
+            return build_dir
+
+        runner.build(
+            vhdl_sources = vhdl_sources,
+            hdl_toplevel = hdl_toplevel,
+            parameters = parameters,
+            build_args = build_args,
+            build_dir = build_dir,
+            always = True, # cache miss. always run the build step
+            clean = True # build fresh
+        )
+        # only written after a successful build. an interrupted build is never reused
+        marker.write_text(key)
+
+    return build_dir
+
+
+def run_id(parameters):
+    """
+    Unique name of a generics combination, e.g. for its working directory
+
+    :param parameters: generics
+    :return: e.g. "G_DATA_WIDTH=8_G_N_COLOR_COMPONENTS=3_G_PIXEL_PER_CLOCK=1"
+    """
+    return "_".join(f"{name}={value}" for name, value in parameters.items())
+
+
+def merge_results(results, results_xml, log_file=None):
+    """
+    Merge the results of several runner.test() calls into one xUnit report and one log
+
+    :param results: list of (run_id, results xml file, log file or None). a results xml file of None (e.g. the
+                    simulator crashed) is merged as one failed test named after the run_id
+    :param results_xml: merged xUnit report to write
+    :param log_file: (optional) merged log to write
+    :return: (number of tests, number of failed tests)
+    """
+    merged = ET.Element("testsuites", name="results")
+    n_tests = n_failed = 0
+    for name, xml_file, _ in results:
+        if xml_file is None:
+            testsuite = ET.SubElement(merged, "testsuite", name=name)
+            testcase = ET.SubElement(testsuite, "testcase", name=name, classname="regression")
+            ET.SubElement(testcase, "failure", message="Simulation terminated abnormally. No results file")
+            n_tests += 1
+            n_failed += 1
+            continue
+        for testsuite in ET.parse(xml_file).getroot().iter("testsuite"):
+            testsuite.set("name", name)
+            for testcase in testsuite.iter("testcase"):
+                n_tests += 1
+                n_failed += testcase.find("failure") is not None
+            merged.append(testsuite)
+    ET.ElementTree(merged).write(results_xml, encoding="UTF-8", xml_declaration=True)
+
+    if log_file is not None:
+        with open(log_file, "w") as f:
+            for name, _, run_log in results:
+                if run_log is not None and Path(run_log).is_file():
+                    f.write(f"{'*' * 18} [{name}] {'*' * 18}\n")
+                    f.write(Path(run_log).read_text())
+
+    return n_tests, n_failed
+
+
+def discover_tests(test_module_file, skipped=False):
+    """
+    Names of the cocotb tests (functions decorated with @cocotb.test()) in a test module, in file order.
+    Tests generated at import time (e.g. by axis_matrix.generate()) are not found
+
+    :param test_module_file: path of the cocotb test module
+    :param skipped: also return tests decorated with a skip argument. cocotb runs tests named in TESTCASE
+                    even if they are skipped
+    :return: list of test names
+    """
+    tests = []
+    for node in ast.parse(Path(test_module_file).read_text()).body:
+        if isinstance(node, ast.AsyncFunctionDef):
+            for decorator in node.decorator_list:
+                target = decorator.func if isinstance(decorator, ast.Call) else decorator
+                if isinstance(target, ast.Attribute) and target.attr == "test":
+                    skip = [keyword.value for keyword in getattr(decorator, "keywords", []) if keyword.arg == "skip"]
+                    if skipped or not skip or (isinstance(skip[0], ast.Constant) and skip[0].value is False):
+                        tests.append(node.name)
+    return tests
+
+
+def results_file(directory):
+    """
+    Results file runner.test() wrote into a directory. It is named results.xml or, when run by pytest,
+    after the current pytest test with a .None suffix. The latest one is returned
+
+    :param directory: test directory
+    :return: path of the results file or None
+    """
+    files = _results_files(directory)
+    return max(files, key=lambda file: file.stat().st_mtime) if files else None
+
+
+def clear_results(directory):
+    """
+    Remove the results files of previous runs from a directory. Called before a run, so results_file() never
+    returns a stale file when the simulator stops before writing its own
+
+    :param directory: test directory
+    """
+    for file in _results_files(directory):
+        file.unlink()
+
+
+def _results_files(directory):
+    return [file for file in Path(directory).glob("*") if file.is_file() and (file.name == "results.xml" or file.suffix == ".None")]
+
+
+def load_durations(store_file):
+    """
+    Durations of previous runs from the results store
+
+    :param store_file: JSON results store written by record_durations()
+    :return: dict run id -> dict test name -> {"time": wall time in s, "sim_time_ns": simulated time in ns}
+    """
+    store_file = Path(store_file)
+    return json.loads(store_file.read_text()) if store_file.is_file() else {}
+
+
+def record_durations(store_file, name, results_xml):
+    """
+    Store the wall time and simulated time of every test in a results XML. Later runs use them for scheduling
+
+    :param store_file: JSON results store
+    :param name: run id of the generics combination
+    :param results_xml: results XML of the run. nothing is recorded if it does not exist
+    """
+    if results_xml is None or not Path(results_xml).is_file():
+        return
+    try:
+        testcases = list(ET.parse(results_xml).getroot().iter("testcase"))
+    except ET.ParseError:
+        return
+
+    # parallel runs update the same store
+    Path(store_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{store_file}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        store = load_durations(store_file)
+        for testcase in testcases:
+            if testcase.get("time") is not None:
+                store.setdefault(name, {})[testcase.get("name")] = {
+                    "time": float(testcase.get("time")),
+                    "sim_time_ns": float(testcase.get("sim_time_ns", 0)),
+                }
+        Path(store_file).write_text(json.dumps(store, indent=4, sort_keys=True))
+
+
+def expected_duration(durations, testcases=None):
+    """
+    Expected wall time of a run
+
+    :param durations: dict test name -> {"time": ...} of one run id, see load_durations()
+    :param testcases: tests of the run. None for all recorded tests
+    :return: sum of the recorded wall times. tests without a record are assumed to take the average
+    """
+    times = {name: record["time"] for name, record in durations.items()}
+    default = sum(times.values())/len(times) if times else 1.0
+    return sum(times.get(name, default) for name in (times if testcases is None else testcases))
+
+
+def shard(testcases, n_shards, durations):
+    """
+    Split tests into shards with about equal total duration (longest first, each into the currently shortest shard)
+
+    :param testcases: test names
+    :param n_shards: maximum number of shards
+    :param durations: dict test name -> {"time": ...}, see load_durations(). unknown tests are assumed to take the average
+    :return: list of non-empty lists of test names
+    """
+    durations = {name: record["time"] for name, record in durations.items()}
+    default = sum(durations.values())/len(durations) if durations else 1.0
+    shards = [[] for _ in range(min(n_shards, len(testcases)))]
+    totals = [0.0] * len(shards)
+    for testcase in sorted(testcases, key=lambda name: durations.get(name, default), reverse=True):
+        idx = totals.index(min(totals))
+        shards[idx].append(testcase)
+        totals[idx] += durations.get(testcase, default)
+    return shards
+
+
+def run_shards(run_test, testcases, n_shards, test_dir, durations, log_file=None):
+    """
+    Run tests split into shards, each shard in its own simulator process, concurrently.
+    Shards are balanced by the durations of previous runs. Results and logs are merged
+    into test_dir/results.xml and log_file
+
+    :param run_test: function(testcase, test_dir, log_file) running one shard, e.g. calling runner.test()
+    :param testcases: test names
+    :param n_shards: maximum number of shards
+    :param test_dir: working directory. shard i runs in test_dir/shard<i>
+    :param durations: dict test name -> {"time": ...}, see load_durations()
+    :param log_file: (optional) merged log
+    :return: merged results XML file
+    """
+    test_dir = Path(test_dir)
+    shards = shard(testcases, n_shards, durations)
+    shard_dirs = [test_dir / f"shard{idx}" for idx in range(len(shards))]
+    shard_logs = [test_dir / f"shard{idx}.log" for idx in range(len(shards))]
+    for shard_dir in shard_dirs:
+        clear_results(shard_dir)
+
+    with ThreadPoolExecutor(len(shards)) as pool:
+        futures = [pool.submit(run_test, testcase, shard_dir, shard_log) for testcase, shard_dir, shard_log in zip(shards, shard_dirs, shard_logs)]
+
+    # merge what was written even if a shard failed, then report the first failure
+    results = [(shard_dir.name, results_file(shard_dir), shard_log) for shard_dir, shard_log in zip(shard_dirs, shard_logs) if results_file(shard_dir) is not None]
+    results_xml = test_dir / "results.xml"
+    merge_results(results, results_xml, log_file)
+    for future in futures:
+        future.result()
+    return results_xml
+
+
+def effective_env(extra_env, names=(), prefixes=()):
+    """
+    Environment variables a simulation started with extra_env sees. cocotb copies the shell environment over
+    extra_env, so a variable set in the shell wins
+
+    :param extra_env: extra_env of runner.test()
+    :param names: (optional) further variables of the shell to include, e.g. read by the test module
+    :param prefixes: (optional) further variables of the shell starting with one of these, e.g. "COCOTB_"
+    :return: dict of variables
+    """
+    env = dict(extra_env)
+    env.update({
+        name: value for name, value in os.environ.items()
+        if name in extra_env or name in names or name.startswith(tuple(prefixes))
+    })
+    return env
+
+
+def fingerprint(sim, parameters, files, env=None):
+    """
+    Content hash of everything the result of a generics combination depends on
+
+    :param sim: simulator name
+    :param parameters: generics
+    :param files: input files, e.g. HDL sources, test module, helpers, stimulus images and the runner (seed, arguments)
+    :param env: (optional) environment of the simulation, see effective_env()
+    :return: hex digest
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps({
+        "sim": sim,
+        "sim_executable": shutil.which(sim),
+        "parameters": {name: str(value) for name, value in sorted(parameters.items())},
+        "packages": {name: importlib.metadata.version(name) for name in ["cocotb", "cocotbext-axi", "numpy"]},
+        "env": env or {},
+    }, sort_keys=True).encode())
+    _hash_files(sha, files)
+    return sha.hexdigest()
+
+
+def cached_passes(store_file, name, key):
+    """
+    Tests of a generics combination that passed with the same fingerprint() before
+
+    :param store_file: JSON store written by record_passes()
+    :param name: run id of the generics combination
+    :param key: current fingerprint()
+    :return: set of test names
+    """
+    store_file = Path(store_file)
+    store = json.loads(store_file.read_text()) if store_file.is_file() else {}
+    return {test for test, test_key in store.get(name, {}).items() if test_key == key}
+
+
+def record_passes(store_file, name, key, results_xml):
+    """
+    Store the fingerprint() of every passed test in a results XML. Failed tests are removed from the store,
+    tests reported as cached are kept
+
+    :param store_file: JSON store
+    :param name: run id of the generics combination
+    :param key: fingerprint() of the run
+    :param results_xml: results XML of the run. nothing is recorded if it does not exist
+    """
+    if results_xml is None or not Path(results_xml).is_file():
+        return
+    try:
+        testcases = list(ET.parse(results_xml).getroot().iter("testcase"))
+    except ET.ParseError:
+        return
+
+    # parallel runs update the same store
+    Path(store_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{store_file}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        store = json.loads(Path(store_file).read_text()) if Path(store_file).is_file() else {}
+        passes = store.setdefault(name, {})
+        for testcase in testcases:
+            if testcase.find("skipped") is not None:
+                continue
+            if testcase.find("failure") is None:
+                passes[testcase.get("name")] = key
+            else:
+                passes.pop(testcase.get("name"), None)
+        Path(store_file).write_text(json.dumps(store, indent=4, sort_keys=True))
+
+
+def add_cached(results_xml, testcases):
+    """
+    Report tests that were not run because of a cached pass as skipped tests in a results XML.
+    The results XML is created if it does not exist
+
+    :param results_xml: results XML
+    :param testcases: names of the cached tests
+    """
+    if Path(results_xml).is_file():
+        tree = ET.parse(results_xml)
+    else:
+        tree = ET.ElementTree(ET.Element("testsuites", name="results"))
+    testsuite = tree.getroot().find("testsuite")
+    if testsuite is None:
+        testsuite = ET.SubElement(tree.getroot(), "testsuite", name="all")
+    for name in testcases:
+        testcase = ET.SubElement(testsuite, "testcase", name=name)
+        ET.SubElement(testcase, "skipped", message="cached pass")
+    tree.write(results_xml, encoding="UTF-8", xml_declaration=True)
+
+
+def failed_tests(results_xml):
+    """
+    Failed tests of a results XML
+
+    :param results_xml: results XML. None or a missing file has no failed tests
+    :return: list of (test name, simulated time of the test in ns)
+    """
+    if results_xml is None or not Path(results_xml).is_file():
+        return []
+    return [(testcase.get("name"), float(testcase.get("sim_time_ns", 0)))
+            for testcase in ET.parse(results_xml).getroot().iter("testcase") if testcase.find("failure") is not None]
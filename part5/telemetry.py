@@ -0,0 +1,64 @@
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from cocotb.utils import get_sim_time
+
+
+class Telemetry:
+
+    def __init__(self, name, clk_period_ns):
+        """
+        Performance record of one test: wall time per phase, simulated time, clock cycles and transferred beats.
+        Created when the test starts
+
+        :param name: name of the test
+        :param clk_period_ns: period of the DUT clock in ns, used to convert simulated time to clock cycles
+        """
+        self.name = name
+        self.clk_period_ns = clk_period_ns
+        self.phases = {}
+        self.beats = 0
+        self._wall_start = time.perf_counter()
+        self._sim_start = get_sim_time("ns")
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measure the wall time of a phase. A phase can be entered several times (e.g. once per line), its times add up.
+        Phases spanning an await also contain the time the simulator runs in between
+
+        :param name: name of the phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def to_dict(self):
+        wall_time = time.perf_counter() - self._wall_start
+        sim_time_ns = get_sim_time("ns") - self._sim_start
+        cycles = sim_time_ns / self.clk_period_ns
+        return {
+            "test": self.name,
+            "wall_time_s": wall_time,
+            "sim_time_ns": sim_time_ns,
+            "cycles": cycles,
+            "cycles_per_s": cycles / wall_time if wall_time else 0.0,
+            "beats": self.beats,
+            "beats_per_s": self.beats / wall_time if wall_time else 0.0,
+            "phases_s": self.phases,
+        }
+
+    def write(self, directory):
+        """
+        Write the record as JSON file <directory>/<test name>.telemetry.json
+
+        :param directory: output directory, e.g. the directory of results.xml
+        :return: path of the written file
+        """
+        file_path = Path(directory) / f"{self.name}.telemetry.json"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(json.dumps(self.to_dict(), indent=4))
+        return file_path
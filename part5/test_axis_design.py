@@ -2,16 +2,37 @@
 import cocotb
 from cocotb.triggers import RisingEdge, FallingEdge, Timer, ClockCycles
 from cocotb.clock import Clock
+from cocotb.queue import Queue
 from cocotbext.axi import (AxiStreamBus, AxiStreamSource, AxiStreamSink, AxiStreamMonitor, AxiStreamFrame)
 from cocotbext.axi import (AxiLiteMaster, AxiLiteBus)
 from AxiStreamImage import AxiStreamImage
+import axis_matrix
+import pause_patterns
+import pixel_packing
+import reference_model
 import utility
+from image_generator import SyntheticImage
+from telemetry import Telemetry
 
 from pathlib import Path
 import logging
 import random
 import math
 import os
+import numpy as np
+
+# Reference kernel and its parameters used for simulation co-processing. see reference_model.KERNELS
+COCO_KERNEL = "increment"
+COCO_KERNEL_PARAMS = {}
+
+# Maximum number of frames (i.e. lines) queued in the AXI stream source
+AXIS_SOURCE_QUEUE_LIMIT_FRAMES = 4
+
+# Period of the DUT clock
+CLK_PERIOD_NS = 5
+
+# Maximum number of images of a video sequence whose expected output is computed ahead of the scoreboard
+SEQUENCE_LOOKAHEAD_IMAGES = 2
 
 async def run_reset_routine(dut):
     for _ in range(3):
@@ -19,9 +40,10 @@ async def run_reset_routine(dut):
     dut.reset_n.value = 1
 
 
-def pause_generator():
-    while True:
-        yield bool(random.getrandbits(1))
+def pause_generator(channel, profile):
+    # pregenerated pause pattern of a profile (see pause_patterns.PROFILES), reproducible per channel and test.
+    # cocotb reseeds random for every test from the simulation seed and the test name, so every test gets its own pattern
+    return pause_patterns.pause_generator(profile, random.getrandbits(64), channel)
 
 
 async def setup_sim(dut):
@@ -30,7 +52,7 @@ async def setup_sim(dut):
     dut._log.setLevel(logging.WARNING)
 
     # Generate a clock
-    cocotb.start_soon(Clock(dut.clk, 5, units="ns").start())
+    cocotb.start_soon(Clock(dut.clk, CLK_PERIOD_NS, units="ns").start())
 
     # Reset DUT reset_n
     dut.reset_n.value = 0
@@ -61,6 +83,7 @@ async def setup_sim(dut):
     await RisingEdge(dut.clk)
 
 
+# idle_inserter/backpressure_inserter: (optional) name of the pause profile of tvalid/tready, e.g. "random"
 async def setup_axis(dut, idle_inserter, backpressure_inserter):
     # Generics
     data_width = int(dut.G_DATA_WIDTH.value)
@@ -73,12 +96,14 @@ async def setup_axis(dut, idle_inserter, backpressure_inserter):
 
     # AXI master
     axis_source = AxiStreamSource(AxiStreamBus.from_prefix(dut, "s_axis_video"), dut.clk, dut.reset_n, reset_active_level=False, byte_size=byte_size)
+    # send() blocks once this many frames (i.e. lines) are queued. keeps the TX side bounded while sink and source run concurrently
+    axis_source.queue_occupancy_limit_frames = AXIS_SOURCE_QUEUE_LIMIT_FRAMES
     if idle_inserter:
-        axis_source.set_pause_generator(idle_inserter)
+        axis_source.set_pause_generator(pause_generator("s_axis_video", idle_inserter))
     # AXI slave
     axis_sink = AxiStreamSink(AxiStreamBus.from_prefix(dut, "m_axis_video"), dut.clk, dut.reset_n, reset_active_level=False, byte_size=byte_size)
     if backpressure_inserter:
-        axis_sink.set_pause_generator(backpressure_inserter)
+        axis_sink.set_pause_generator(pause_generator("m_axis_video", backpressure_inserter))
 
     return axis_source, axis_sink
 
@@ -88,107 +113,97 @@ async def setup_axilite(dut, idle_inserter, backpressure_inserter):
     # NOTE By default, AxiLiteMaster assumes a 32-bit data width
     axilite_master = AxiLiteMaster(AxiLiteBus.from_prefix(dut, "s_axi_ctrl"), dut.clk, dut.reset_n, reset_active_level=False)
     if idle_inserter:
-        axilite_master.write_if.aw_channel.set_pause_generator(pause_generator())
-        axilite_master.write_if.w_channel.set_pause_generator(pause_generator())
-        axilite_master.read_if.ar_channel.set_pause_generator(pause_generator())
+        axilite_master.write_if.aw_channel.set_pause_generator(pause_generator("s_axi_ctrl_aw", idle_inserter))
+        axilite_master.write_if.w_channel.set_pause_generator(pause_generator("s_axi_ctrl_w", idle_inserter))
+        axilite_master.read_if.ar_channel.set_pause_generator(pause_generator("s_axi_ctrl_ar", idle_inserter))
     if backpressure_inserter:
-        axilite_master.write_if.b_channel.set_pause_generator(pause_generator())
-        axilite_master.read_if.r_channel.set_pause_generator(pause_generator())
+        axilite_master.write_if.b_channel.set_pause_generator(pause_generator("s_axi_ctrl_b", backpressure_inserter))
+        axilite_master.read_if.r_channel.set_pause_generator(pause_generator("s_axi_ctrl_r", backpressure_inserter))
 
     return axilite_master
 
 
-async def send(dut, axis_source, n_frames, tx_data, width, height):
+async def send(dut, axis_source, n_frames, tx_data, width, height, telemetry):
     # generics
     pixel_per_clock = int(dut.G_PIXEL_PER_CLOCK.value)
     data_width = int(dut.G_DATA_WIDTH.value)
     n_color_components = int(dut.G_N_COLOR_COMPONENTS.value)
-    # >1 PPC parameters
-    bit_shift = data_width*n_color_components
+
+    # pack pixels of the whole image once. >1 PPC data is concatenated per beat
+    # memory-mapped or generated stimulus is packed line by line while it is streamed instead
+    with telemetry.phase("pack"):
+        if hasattr(tx_data, 'shape') and not isinstance(tx_data, np.ndarray):
+            data = pixel_packing.PackedLines(tx_data, pixel_per_clock, data_width*n_color_components)
+        else:
+            data = pixel_packing.pack(np.reshape(tx_data, (height, width)), pixel_per_clock, data_width*n_color_components).ravel()
+    # NOTE: always add pixel-by-pixel image data regardless of pixel per clock. same image for every frame
+    tx_image = AxiStreamImage(tx_data, width, height)
 
     # send images
     axis_images = []
     for _ in range(n_frames):
-        # 1 PPC
-        if pixel_per_clock == 1:
-            axis_image = AxiStreamImage(tx_data, width, height)
-        # 2 PPC
-        elif pixel_per_clock == 2:
-            data = [(tx_data[i+1] << (1 * bit_shift) |
-                     tx_data[i]) for i in range(0, len(tx_data), 2)]
-            axis_image = AxiStreamImage(data, width//pixel_per_clock, height)
-        # 4 PPC
-        elif pixel_per_clock == 4:
-            data = [(tx_data[i+3] << (3 * bit_shift) |
-                     tx_data[i+2] << (2 * bit_shift) |
-                     tx_data[i+1] << (1 * bit_shift) |
-                     tx_data[i]) for i in range(0, len(tx_data), 4)]
-            axis_image = AxiStreamImage(data, width//pixel_per_clock, height)
-        else:
-            dut._log.critical("Error in send(): {pixel_per_clock} PPC processing is not supported. Supported values are 1,2,4")
-            raise ValueError
+        axis_image = AxiStreamImage(data, width//pixel_per_clock, height)
 
-        # send stream image
+        # send stream image. frames are queued back-to-back without waiting for the previous image
         await axis_image.send(axis_source)
-        await axis_source.wait() # wait until axi stream source is idle again i.e. all data has been send
 
-        # NOTE: always add pixel-by-pixel image data regardless of pixel per clock
-        axis_images.append(AxiStreamImage(tx_data, width, height))
+        axis_images.append(tx_image)
+
+    await axis_source.wait() # wait until axi stream source is idle again i.e. all data has been send
 
     return axis_images
 
 
-async def recv(dut, axis_sink, n_frames, height):
+async def send_sequence(dut, axis_source, images, expected, telemetry):
+    # images: iterator of (data, width, height, max_value) per image, e.g. utility.map_pnm_sequence()
+    # expected: queue that gets (co-processing future, width, height, max_value) of every image before it is sent.
+    # None marks the end of the sequence
+    pixel_per_clock = int(dut.G_PIXEL_PER_CLOCK.value)
+    data_width = int(dut.G_DATA_WIDTH.value)
+    n_color_components = int(dut.G_N_COLOR_COMPONENTS.value)
+
+    for tx_data, width, height, max_value in images:
+        with telemetry.phase("coco"):
+            coco_future = start_coco(dut, tx_data, width, height)
+        # blocks while the scoreboard is SEQUENCE_LOOKAHEAD_IMAGES images behind
+        await expected.put((coco_future, width, height, max_value))
+
+        # packed line by line while it is streamed, images are queued back-to-back
+        with telemetry.phase("pack"):
+            data = pixel_packing.PackedLines(tx_data, pixel_per_clock, data_width*n_color_components)
+        await AxiStreamImage(data, width//pixel_per_clock, height).send(axis_source)
+
+    await expected.put(None)
+    await axis_source.wait() # wait until axi stream source is idle again i.e. all data has been send
+
+
+async def recv_frame(dut, axis_sink, telemetry):
     pixel_per_clock = int(dut.G_PIXEL_PER_CLOCK.value)
     data_width = int(dut.G_DATA_WIDTH.value)
     n_color_components = int(dut.G_N_COLOR_COMPONENTS.value)
-    # >1 PPC parameters
-    bit_mask = 2**(data_width*n_color_components)-1
-    bit_shift = data_width*n_color_components
 
+    # receive 1 frame i.e. line. compact=False ensures that tuser signal is kept as type <list>
+    rx_frame = await axis_sink.recv(compact=False)
+    ## await axis_sink.wait()
+    telemetry.beats += len(rx_frame.tdata)
+
+    # slice >1 PPC data into single pixels.
+    # cast recv data to int (avoids list of 8-bit values being interpreted as byte array by AxiStreamFrame)
+    with telemetry.phase("unpack"):
+        result_tdata = pixel_packing.unpack(rx_frame.tdata, pixel_per_clock, data_width*n_color_components).tolist()
+        result_tuser = pixel_packing.unpack_tuser(rx_frame.tuser, pixel_per_clock)
+
+    return AxiStreamFrame(tdata=result_tdata, tuser=result_tuser)
+
+
+async def recv(dut, axis_sink, n_frames, height, telemetry):
     # receive images
     rx_axis_images = []
     for _ in range(n_frames):
         rx_frames = []
         for _ in range(height):
-            # receive 1 frame i.e. line. compact=False ensures that tuser signal is kept as type <list>
-            rx_frame = await axis_sink.recv(compact=False)
-            ## await axis_sink.wait()
-
-            result_tdata = []
-            result_tuser = []
-
-            # 1 PPC
-            if pixel_per_clock == 1:
-                # cast recv data to int (avoids list of 8-bit values being interpreted as byte array by AxiStreamFrame)
-                result_tdata = [int(num) for num in rx_frame.tdata]
-                result_tuser = [int(num) for num in rx_frame.tuser]
-            # 2 PPC
-            elif pixel_per_clock == 2:
-                result_tdata = []
-                for num in rx_frame.tdata:
-                    result_tdata.extend([
-                        num & bit_mask,
-                        (num >> (1 * bit_shift)) & bit_mask,
-                    ])
-                result_tuser = [value for num in rx_frame.tuser for value in [num, 0]]
-            # 4 PPC
-            elif pixel_per_clock == 4:
-                result_tdata = []
-                for num in rx_frame.tdata:
-                    result_tdata.extend([
-                        num & bit_mask,
-                        (num >> (1 * bit_shift)) & bit_mask,
-                        (num >> (2 * bit_shift)) & bit_mask,
-                        (num >> (3 * bit_shift))
-                    ])
-                result_tuser = [value for num in rx_frame.tuser for value in [num, 0, 0, 0]]
-            else:
-                dut._log.critical("Error in send(): {pixel_per_clock} PPC processing is not supported. Supported values are 1,2,4")
-                raise ValueError
-
             # collect frame
-            rx_frames.append(AxiStreamFrame(tdata=result_tdata, tuser=result_tuser))
+            rx_frames.append(await recv_frame(dut, axis_sink, telemetry))
 
         # NOTE: always add pixel-by-pixel image data regardless of pixel per clock
         rx_axis_images.append(AxiStreamImage.from_frames(rx_frames))
@@ -199,75 +214,232 @@ async def recv(dut, axis_sink, n_frames, height):
     return rx_axis_images
 
 
-def coco(n_frames, tx_data, width, height):
-    coco_images = []
-    for _ in range(n_frames):
-        coco_frames = []
-        for line in range(height):
-            coco_pixels = []
-            for pixel in range(width):
-                #### #### #### #### #### #### #### #### #### #### #### ####
+def start_coco(dut, tx_data, width, height):
+    data_width = int(dut.G_DATA_WIDTH.value)
+    n_color_components = int(dut.G_N_COLOR_COMPONENTS.value)
 
-                # n = random.choices([0, 1], weights=[1, 99], k=1)[0]
-                # simulation co-processing. implements the same operation as HW code
-                coco_pixel = tx_data[line*width+pixel] + 1
+    # results of cacheable kernels computed before for the same image, generics and kernel version are taken
+    # from disk (see COCO_CACHE_DIR)
+    cache = None
+    if os.environ.get('COCO_CACHE_DIR'):
+        cache = reference_model.OutputCache(os.environ['COCO_CACHE_DIR'], int(os.environ.get('COCO_CACHE_MAX_MB', '256'))*2**20)
 
-                #### #### #### #### #### #### #### #### #### #### #### ####
-                coco_pixels.append(coco_pixel)
-            tuser = [1 if line == 0 else 0] + [0] * (width - 1)
-            coco_frames.append(AxiStreamFrame(tdata=coco_pixels, tuser=tuser))
-        coco_images.append(AxiStreamImage.from_frames(coco_frames))
-    return coco_images
+    # simulation co-processing. applies the reference kernel to the whole image at once.
+    # runs inline or in a worker pool in parallel to the simulation (see COCO_EXECUTOR)
+    return reference_model.submit(os.environ.get('COCO_EXECUTOR', 'inline'), COCO_KERNEL, np.reshape(tx_data, (height, width)), data_width, n_color_components, cache=cache, **COCO_KERNEL_PARAMS)
+
+
+async def coco(dut, n_frames, coco_future, width, height):
+    # let the simulator run until the reference model result is available
+    while not coco_future.done():
+        await RisingEdge(dut.clk)
+
+    # all input frames are identical, so the expected image is computed once and shared
+    coco_image = AxiStreamImage(coco_future.result().ravel(), width, height)
+    return [coco_image] * n_frames
+
+
+def assert_tuser_frame(rx_frame, frame_idx):
+    for pixel_idx, rx_tuser in enumerate(rx_frame.tuser): # all pixel in a line
+        # check tuser signal
+        if frame_idx == 0 and pixel_idx == 0:
+            assert rx_tuser == 1, "tuser is not 1 for first pixel in first line"
+        else:
+            assert rx_tuser == 0, f"tuser is not 0 for line: {frame_idx} pixel: {pixel_idx}"
+
+
+def assert_tdata_frame(coco_frame, rx_frame, image_idx, frame_idx):
+    for pixel_idx, (coco_data, rx_tdata) in enumerate(zip(coco_frame, rx_frame.tdata)): # all pixel in a line
+        # check tdata signal
+        assert rx_tdata == coco_data, f"data mismatch in image: {image_idx} line: {frame_idx} pixel: {pixel_idx}"
 
 
 def assert_tuser_signal(axis_rx_images):
     for rx_image in axis_rx_images:  # all images (n * width * height)
         for frame_idx, rx_frame in enumerate(rx_image): # all "frames" i.e. lines (width * height)
-            for pixel_idx, rx_tuser in enumerate(rx_frame.tuser): # all pixel in a line
-                # check tuser signal
-                if frame_idx == 0 and pixel_idx == 0:
-                    assert rx_tuser == 1, "tuser is not 1 for first pixel in first line"
-                else:
-                    assert rx_tuser == 0, f"tuser is not 0 for line: {frame_idx} pixel: {pixel_idx}"
+            assert_tuser_frame(rx_frame, frame_idx)
 
 
 def assert_tdata_signal(coco_images, axis_rx_images):
     for image_idx, (coco_image, rx_image) in enumerate(zip(coco_images, axis_rx_images)):  # all images (n * width * height)
         for frame_idx, (coco_frame, rx_frame) in enumerate(zip(coco_image, rx_image)): # all "frames" i.e. lines (width * height)
-            for pixel_idx, (coco_data, rx_tdata) in enumerate(zip(coco_frame, rx_frame.tdata)): # all pixel in a line
-                # check tdata signal
-                assert rx_tdata == coco_data, f"data mismatch in image: {image_idx} line: {frame_idx} pixel: {pixel_idx}"
+            assert_tdata_frame(coco_frame, rx_frame, image_idx, frame_idx)
+
+
+async def scoreboard_image(dut, axis_sink, coco_image, image_idx, max_value, telemetry):
+    # Receive frames (i.e. lines) of one image and compare each one against its expected frame as soon as it arrives.
+    # Only the current line is held in memory. If image output is written, lines of the image
+    # are collected until the image is complete
+    write_image_output = os.environ.get('WRITE_IMAGE_OUTPUT') == 'True'
+
+    rx_frames = []
+    for frame_idx in range(coco_image.height):
+        with telemetry.phase("recv"):
+            rx_frame = await recv_frame(dut, axis_sink, telemetry)
+
+        # ASSERT
+        with telemetry.phase("assert"):
+            assert_tuser_frame(rx_frame, frame_idx)
+            assert_tdata_frame(coco_image[frame_idx], rx_frame, image_idx, frame_idx)
+
+        if write_image_output:
+            rx_frames.append(rx_frame)
+
+    # WRITE FILE
+    if write_image_output:
+        with telemetry.phase("write"):
+            write_image(dut, AxiStreamImage.from_frames(rx_frames), image_idx, max_value)
+
+
+async def scoreboard(dut, axis_sink, n_frames, coco_future, width, height, max_value, telemetry):
+    # CO-PROCESSING
+    with telemetry.phase("coco"):
+        coco_images = await coco(dut, n_frames, coco_future, width, height)
+
+    for image_idx, coco_image in enumerate(coco_images):
+        await scoreboard_image(dut, axis_sink, coco_image, image_idx, max_value, telemetry)
+
+    # wait one more clock cycle before ending simulation (optional)
+    await RisingEdge(dut.clk)
+
+
+async def scoreboard_sequence(dut, axis_sink, expected, telemetry):
+    # expected output of one image after the other, as queued by send_sequence()
+    image_idx = 0
+    while (item := await expected.get()) is not None:
+        coco_future, width, height, max_value = item
 
+        # CO-PROCESSING
+        with telemetry.phase("coco"):
+            coco_image, = await coco(dut, 1, coco_future, width, height)
 
-async def axi_stream(dut, n_frames, size, idle_inserter, backpressure_inserter):
+        await scoreboard_image(dut, axis_sink, coco_image, image_idx, max_value, telemetry)
+        image_idx += 1
+
+    # wait one more clock cycle before ending simulation (optional)
+    await RisingEdge(dut.clk)
+
+
+def write_image(dut, rx_image, idx, max_value):
+    # the format has to hold G_N_COLOR_COMPONENTS components per pixel, e.g. P3/P6 for RGB and P2/P5 for greyscale
+    image_format = os.environ.get('IMAGE_OUTPUT_FORMAT', 'P3')
+    n_color_components = int(dut.G_N_COLOR_COMPONENTS.value)
+    if image_format in utility.PNM_FORMATS and utility.PNM_FORMATS[image_format][0] != n_color_components:
+        raise ValueError(f"IMAGE_OUTPUT_FORMAT={image_format} holds {utility.PNM_FORMATS[image_format][0]} color components per pixel, G_N_COLOR_COMPONENTS is {n_color_components}")
+    output_dir = os.environ.get('IMAGE_OUTPUT_DIR', f"{Path(__file__).resolve().parent}/images/output")
+    os.makedirs(output_dir, exist_ok=True)
+    utility.write_pnm(rx_image.data(), rx_image.width, rx_image.height, max_value, f"{output_dir}/output_{idx:04d}.pnm", format=image_format)
+
+
+async def timed(telemetry, phase, coro):
+    # wall time of a concurrent task, from its start until it returns
+    with telemetry.phase(phase):
+        return await coro
+
+
+async def axi_stream(dut, test_name, n_frames, size, idle_inserter, backpressure_inserter, pattern=None):
+    # test_name: name of the calling test, names the telemetry file
+    # pattern: (optional) generated stimulus of the given size instead of an image file, see image_generator.PATTERNS
+    # wall time per phase, simulated time and beats are written as JSON next to results.xml, also if the test fails
+    telemetry = Telemetry(test_name, CLK_PERIOD_NS)
+    try:
+        await axi_stream_phases(dut, n_frames, size, idle_inserter, backpressure_inserter, pattern, telemetry)
+    finally:
+        telemetry.write(Path(os.environ.get('COCOTB_RESULTS_FILE', 'results.xml')).resolve().parent)
+
+
+async def axi_stream_phases(dut, n_frames, size, idle_inserter, backpressure_inserter, pattern, telemetry):
 
     # SETUP
-    axis_source, axis_sink = await setup_axis(dut, idle_inserter, backpressure_inserter)
-    axilite_master = await setup_axilite(dut, None, None)
-    await setup_sim(dut)
+    with telemetry.phase("setup"):
+        axis_source, axis_sink = await setup_axis(dut, idle_inserter, backpressure_inserter)
+        axilite_master = await setup_axilite(dut, None, None)
+        await setup_sim(dut)
 
     # READ FILE
-    tx_data, width, height, max_value = utility.read_pnm(f"{Path(__file__).resolve().parent}/images/RGBRandom_{size}_{int(dut.G_DATA_WIDTH.value)}bit.pnm")
+    # memory-mapped stimulus is decoded lazily, line by line, while it is sent. generated stimulus is
+    # generated line by line, seeded by the simulation seed
+    with telemetry.phase("read"):
+        if pattern is not None:
+            width, height = map(int, size.split("x"))
+            tx_data = SyntheticImage(pattern, width, height, int(dut.G_DATA_WIDTH.value), int(dut.G_N_COLOR_COMPONENTS.value), seed=cocotb.RANDOM_SEED)
+            max_value = tx_data.max_value
+        else:
+            image_dir = os.environ.get('IMAGE_DIR', f"{Path(__file__).resolve().parent}/images")
+            file_path = f"{image_dir}/RGBRandom_{size}_{int(dut.G_DATA_WIDTH.value)}bit.pnm"
+            if os.environ.get('MMAP_STIMULUS') == 'True':
+                tx_data, width, height, max_value = utility.map_pnm(file_path)[0]
+            else:
+                # parsed once per simulation and shared by all tests
+                tx_data, width, height, max_value = utility.read_pnm_cached(file_path, os.environ.get('STIMULUS_CACHE_DIR') or None)
+
+    # CO-PROCESSING
+    # started right away. the result is only awaited when it is needed for comparison
+    with telemetry.phase("coco"):
+        coco_future = start_coco(dut, tx_data, width, height)
 
     # SEND
-    axis_tx_images = await send(dut, axis_source, n_frames, tx_data, width, height)
+    # stimulus and capture run as concurrent tasks so frames are streamed back-to-back through the DUT
+    send_task = cocotb.start_soon(timed(telemetry, "send", send(dut, axis_source, n_frames, tx_data, width, height, telemetry)))
+
+    # STREAMING SCOREBOARD
+    # co-processing, recv, write file and assert line by line. fails on the first mismatching line
+    if os.environ.get('STREAMING_SCOREBOARD') == 'True':
+        scoreboard_task = cocotb.start_soon(scoreboard(dut, axis_sink, n_frames, coco_future, width, height, max_value, telemetry))
+        await send_task
+        await scoreboard_task
+        assert axis_source.empty(), "AxiStreamMaster (source) not empty"
+        assert axis_sink.empty(), "AxiStreamSource (sink) not empty"
+        return
+
+    # RECV
+    recv_task = cocotb.start_soon(timed(telemetry, "recv", recv(dut, axis_sink, n_frames, height, telemetry)))
 
     # CO-PROCESSING
-    coco_images = coco(n_frames, tx_data, width, height)
+    with telemetry.phase("coco"):
+        coco_images = await coco(dut, n_frames, coco_future, width, height)
 
-    # RECV
-    axis_rx_images = await recv(dut, axis_sink, n_frames, height)
+    # join stimulus and capture
+    axis_tx_images = await send_task
+    axis_rx_images = await recv_task
 
     # WRITE FILE
     if os.environ.get('WRITE_IMAGE_OUTPUT') == 'True':
-        for idx, rx_image in enumerate(axis_rx_images):
-            utility.write_pnm(rx_image.data(), width, height, max_value, f"{Path(__file__).resolve().parent}/images/output/output_{idx:04d}.pnm", format='P3')
+        with telemetry.phase("write"):
+            for idx, rx_image in enumerate(axis_rx_images):
+                write_image(dut, rx_image, idx, max_value)
 
     # ASSERT
-    assert axis_source.empty(), "AxiStreamMaster (source) not empty"
-    assert axis_sink.empty(), "AxiStreamSource (sink) not empty"
-    assert_tuser_signal(axis_rx_images)
-    assert_tdata_signal(coco_images, axis_rx_images)
+    with telemetry.phase("assert"):
+        assert axis_source.empty(), "AxiStreamMaster (source) not empty"
+        assert axis_sink.empty(), "AxiStreamSource (sink) not empty"
+        assert_tuser_signal(axis_rx_images)
+        assert_tdata_signal(coco_images, axis_rx_images)
+
+
+async def axi_stream_sequence(dut, path, idle_inserter, backpressure_inserter):
+    # path: PNM file with several images or directory of PNM files, see utility.map_pnm_sequence().
+    # every image is sent once and checked against its own expected output. images are memory-mapped when the
+    # sequence reaches them and at most SEQUENCE_LOOKAHEAD_IMAGES expected images are held at a time
+    telemetry = Telemetry("run_axi_stream_sequence", CLK_PERIOD_NS)
+    try:
+        # SETUP
+        with telemetry.phase("setup"):
+            axis_source, axis_sink = await setup_axis(dut, idle_inserter, backpressure_inserter)
+            axilite_master = await setup_axilite(dut, None, None)
+            await setup_sim(dut)
+
+        # SEND, CO-PROCESSING and STREAMING SCOREBOARD
+        expected = Queue(maxsize=SEQUENCE_LOOKAHEAD_IMAGES)
+        send_task = cocotb.start_soon(timed(telemetry, "send", send_sequence(dut, axis_source, utility.map_pnm_sequence(path), expected, telemetry)))
+        await scoreboard_sequence(dut, axis_sink, expected, telemetry)
+        await send_task
+
+        # ASSERT
+        assert axis_source.empty(), "AxiStreamMaster (source) not empty"
+        assert axis_sink.empty(), "AxiStreamSource (sink) not empty"
+    finally:
+        telemetry.write(Path(os.environ.get('COCOTB_RESULTS_FILE', 'results.xml')).resolve().parent)
 
 
 async def axi_lite(dut, idle_inserter, backpressure_inserter):
@@ -313,81 +485,13 @@ async def axi_lite(dut, idle_inserter, backpressure_inserter):
     assert registers[3] == write_value_register3
 
 
-# NOTE: In cocotb 2.0 the first 16 tests specified below will be something like this instead:
-#
-# @cocotb.parametrize(
-#     n_frames=[1, 3],
-#     size=["4x3", "20x10"],
-#     idle_inserter=[None, pause_generator()],
-#     backpressure_inserter=[None, pause_generator()],
-# )
-# @cocotb.test()
-# async def run_axi_stream(dut, n_frames, idle_inserter, backpressure_inserter):
-#     await axi_stream(dut, idle_inserter, backpressure_inserter)
-
-@cocotb.test()
-async def run_axi_stream_1_frame_4x3(dut):
-    await axi_stream(dut, 1, "4x3", None, None)
-
-@cocotb.test()
-async def run_axi_stream_1_frame_4x3_random_tvalid(dut):
-    await axi_stream(dut, 1, "4x3", pause_generator(), None)
-
-@cocotb.test()
-async def run_axi_stream_1_frame_4x3_random_tready(dut):
-    await axi_stream(dut, 1, "4x3", None, pause_generator())
+# run_axi_stream tests. one test per combination of the axes declared in axis_matrix,
+# e.g. run_axi_stream_1_frame_4x3 or run_axi_stream_3_frames_20x10_random_tvalid_random_tready
+async def axi_stream_point(dut, n_frames, size, pattern, pause):
+    test_name = axis_matrix.test_name({"n_frames": n_frames, "size": size, "pattern": pattern, "pause": pause})
+    await axi_stream(dut, test_name, n_frames, size, *axis_matrix.PAUSES[pause], pattern)
 
-@cocotb.test()
-async def run_axi_stream_1_frame_4x3_random_tvalid_random_tready(dut):
-    await axi_stream(dut, 1, "4x3", pause_generator(), pause_generator())
-
-@cocotb.test()
-async def run_axi_stream_3_frames_4x3(dut):
-    await axi_stream(dut, 3, "4x3", None, None)
-
-@cocotb.test()
-async def run_axi_stream_3_frames_4x3_random_tvalid(dut):
-    await axi_stream(dut, 3, "4x3", pause_generator(), None)
-
-@cocotb.test()
-async def run_axi_stream_3_frames_4x3_random_tready(dut):
-    await axi_stream(dut, 3, "4x3", None, pause_generator())
-
-@cocotb.test()
-async def run_axi_stream_3_frames_4x3_random_tvalid_random_tready(dut):
-    await axi_stream(dut, 3, "4x3", pause_generator(), pause_generator())
-
-@cocotb.test()
-async def run_axi_stream_1_frame_20x10(dut):
-    await axi_stream(dut, 1, "20x10", None, None)
-
-@cocotb.test()
-async def run_axi_stream_1_frame_20x10_random_tvalid(dut):
-    await axi_stream(dut, 1, "20x10", pause_generator(), None)
-
-@cocotb.test()
-async def run_axi_stream_1_frame_20x10_random_tready(dut):
-    await axi_stream(dut, 1, "20x10", None, pause_generator())
-
-@cocotb.test()
-async def run_axi_stream_1_frame_20x10_random_tvalid_random_tready(dut):
-    await axi_stream(dut, 1, "20x10", pause_generator(), pause_generator())
-
-@cocotb.test()
-async def run_axi_stream_3_frames_20x10(dut):
-    await axi_stream(dut, 3, "20x10", None, None)
-
-@cocotb.test()
-async def run_axi_stream_3_frames_20x10_random_tvalid(dut):
-    await axi_stream(dut, 3, "20x10", pause_generator(), None)
-
-@cocotb.test()
-async def run_axi_stream_3_frames_20x10_random_tready(dut):
-    await axi_stream(dut, 3, "20x10", None, pause_generator())
-
-@cocotb.test()
-async def run_axi_stream_3_frames_20x10_random_tvalid_random_tready(dut):
-    await axi_stream(dut, 3, "20x10", pause_generator(), pause_generator())
+axis_matrix.generate(globals(), axi_stream_point)
 
 @cocotb.test()
 async def run_axi_lite(dut):
@@ -395,15 +499,33 @@ async def run_axi_lite(dut):
 
 @cocotb.test()
 async def run_axi_lite_random_tvalid(dut):
-    await axi_lite(dut, pause_generator(), None)
+    await axi_lite(dut, "random", None)
 
 @cocotb.test()
 async def run_axi_lite_random_tready(dut):
-    await axi_lite(dut, None, pause_generator())
+    await axi_lite(dut, None, "random")
 
 @cocotb.test()
 async def run_axi_lite_random_tvalid_random_tready(dut):
-    await axi_lite(dut, pause_generator(), pause_generator())
+    await axi_lite(dut, "random", "random")
+
+# Throughput benchmark. benchmark.py sets image size, number of frames, handshake randomization
+# ("none", "tvalid", "tready" or "tvalid_tready") with its pause profile (see pause_patterns.PROFILES) and the generated
+# stimulus pattern as environment variables. skipped otherwise
+@cocotb.test(skip='BENCHMARK_SIZE' not in os.environ)
+async def run_axi_stream_benchmark(dut):
+    handshake = os.environ.get('BENCHMARK_HANDSHAKE', 'none')
+    profile = os.environ.get('BENCHMARK_PAUSE_PROFILE', 'random')
+    await axi_stream(dut, "run_axi_stream_benchmark", int(os.environ.get('BENCHMARK_FRAMES', '1')), os.environ['BENCHMARK_SIZE'],
+                     profile if 'tvalid' in handshake else None,
+                     profile if 'tready' in handshake else None,
+                     os.environ.get('BENCHMARK_PATTERN', 'random'))
+
+# Video sequence. IMAGE_SEQUENCE is a PNM file with several images or a directory of PNM files, e.g.
+# IMAGE_SEQUENCE=/path/to/frames TESTS=run_axi_stream_sequence python test_runner.py. skipped otherwise
+@cocotb.test(skip='IMAGE_SEQUENCE' not in os.environ)
+async def run_axi_stream_sequence(dut):
+    await axi_stream_sequence(dut, os.environ['IMAGE_SEQUENCE'], None, None)
 
 @cocotb.test()
 async def run_toplevel_generics_range(dut):
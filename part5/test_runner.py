@@ -1,73 +1,298 @@
 import os
+import sys
 import glob
+import itertools
 import pytest
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from cocotb.runner import get_runner
+from cocotb.runner import get_results, get_runner
+import regression
+import axis_matrix
 
 # DUT generics
 G_DATA_WIDTH = [8, 10, 12, 16]
 G_N_COLOR_COMPONENTS = [3]
 G_PIXEL_PER_CLOCK = [1, 2, 4]
 
-@pytest.mark.parametrize("g_data_width", G_DATA_WIDTH, ids=[f" G_DATA_WIDTH={i} " for i in G_DATA_WIDTH])
-@pytest.mark.parametrize("g_n_color_components", G_N_COLOR_COMPONENTS, ids=[f" G_N_COLOR_COMPONENTS={i} " for i in G_N_COLOR_COMPONENTS])
-@pytest.mark.parametrize("g_pixel_per_clock", G_PIXEL_PER_CLOCK, ids=[f" G_PIXEL_PER_CLOCK={i} " for i in G_PIXEL_PER_CLOCK])
-def test_axis_design_runner(
+# wall time and simulated time of every (generics combination, test) of previous runs
+RESULTS_STORE = Path(__file__).resolve().parent / "sim_run" / "durations.json"
+
+# fingerprint of the inputs of every (generics combination, test) that passed
+PASS_STORE = Path(__file__).resolve().parent / "sim_run" / "passes.json"
+
+# waveform dump. "never", "always" or "on_failure": failed tests are re-run alone with the same seed and
+# only then dump WAVE_SIGNALS until WAVE_MARGIN_NS after the time the test failed.
+# WAVE_SIGNALS is a comma separated list of signal paths, e.g. "/axis_design/s_axis_video_*,/axis_design/m_axis_video_*".
+# "" dumps all signals
+WAVES = os.getenv("WAVES", "on_failure")
+WAVE_SIGNALS = [signal for signal in os.getenv("WAVE_SIGNALS", "/axis_design/*").split(",") if signal]
+WAVE_MARGIN_NS = int(os.getenv("WAVE_MARGIN_NS", "100"))
+
+# generated run_axi_stream tests (see axis_matrix) to run instead of the default testcase selection.
+# regular expression on the test names, e.g. "_20x10" or "3_frames.*tready". ".*" selects all of them.
+# MATRIX_MAX_COST limits them by estimated cost, MATRIX_ORDER "cheapest" runs cheap tests first
+MATRIX_FILTER = os.getenv("MATRIX_FILTER")
+MATRIX_MAX_COST = int(os.getenv("MATRIX_MAX_COST")) if os.getenv("MATRIX_MAX_COST") else None
+MATRIX_ORDER = os.getenv("MATRIX_ORDER", "cheapest")
+
+# environment variables of the shell that change test results besides the simulation environment of run(),
+# part of the fingerprint of incremental runs. read by the test module (stimulus, benchmark) and by cocotb
+FINGERPRINT_ENV = ["IMAGE_DIR", "IMAGE_SEQUENCE", "RANDOM_SEED", "PLUSARGS"]
+FINGERPRINT_ENV_PREFIXES = ["BENCHMARK_", "COCOTB_"]
+
+
+def run(
     g_data_width,
     g_n_color_components,
-    g_pixel_per_clock
+    g_pixel_per_clock,
+    log_file = None,
+    shards = int(os.getenv("SHARDS", "1")),
+    incremental = os.getenv("INCREMENTAL", "False") == "True",
+    tests = os.getenv("TESTS"),
+    env = None,
+    run_dir = None
 ):
+    # tests: (optional) tests to run instead of the default selection below. a list or comma separated names.
+    #        "all" runs every test that is not skipped, including the generated run_axi_stream tests up to axis_matrix.MAX_COST
+    # env: (optional) environment variables of the simulation overriding the defaults below
+    # run_dir: (optional) directory of the working directories, durations and passes instead of sim_run,
+    #          e.g. for benchmarks that must not replace the results of the regression
     sim = os.getenv("SIM", "ghdl")
 
     proj_path = Path(__file__).resolve().parent
 
     runner = get_runner(sim)
 
+    # arguments are translated per simulator (VHDL standard, waveform dump). SIM=ghdl or SIM=nvc
+    args = regression.sim_args(sim)
+
     hdl_toplevel = "axis_design"
 
-    runner.build(
-        vhdl_sources = glob.glob(f"{proj_path}/*.vhd"),
+    parameters = {
+        "G_DATA_WIDTH": g_data_width,
+        "G_N_COLOR_COMPONENTS": g_n_color_components,
+        "G_PIXEL_PER_CLOCK": g_pixel_per_clock
+    }
 
+    # build is cached by content hash of sources, generics, simulator and build args
+    # an unchanged build is reused, any relevant change builds fresh into a new directory.
+    # sources are analyzed once for all generics, generics are applied when the design is elaborated in test()
+    build_dir = regression.cached_build(
+        runner,
+        sim,
+        build_root = proj_path / "sim_build",
         hdl_toplevel = hdl_toplevel,
-        parameters = {
-            "G_DATA_WIDTH": g_data_width,
-            "G_N_COLOR_COMPONENTS": g_n_color_components,
-            "G_PIXEL_PER_CLOCK": g_pixel_per_clock
-        },
-        build_args = [
-            "--std=08",
-        ],
-        always = True, # always run the build step
-        clean = True # build fresh
+        vhdl_sources = glob.glob(f"{proj_path}/*.vhd"),
+        parameters = regression.build_parameters(sim, parameters),
+        build_args = args["build_args"],
     )
 
-    runner.test(
-        test_module = "test_axis_design",
-        hdl_toplevel = hdl_toplevel,
-        hdl_toplevel_lang = "vhdl",
-        seed = 1871423625,
-        test_args = [
-            "--std=08"
-        ],
-        plusargs = [
-            "--fst=waveform.ghw",
-        ],
-        extra_env = {
+    # every generics combination runs in its own working directory (results, waveform, output images)
+    # so combinations can run in parallel. the simulator finds the analyzed library in build_dir by work_args,
+    # GHDL LLVM/GCC finds the executable linked into the working directory by link_executable
+    if run_dir is None:
+        run_dir, results_store, pass_store = proj_path / "sim_run", RESULTS_STORE, PASS_STORE
+    else:
+        run_dir, results_store, pass_store = Path(run_dir), Path(run_dir) / RESULTS_STORE.name, Path(run_dir) / PASS_STORE.name
+    test_dir = run_dir / regression.run_id(parameters)
+    work_args = regression.work_args(sim, build_dir)
+    runner.build_args = [*runner.build_args, *work_args["build_args"]]
+
+    # tests to run. None runs the AXI lite tests
+    if tests == "all":
+        tests = regression.discover_tests(proj_path / "test_axis_design.py") + axis_matrix.select(max_cost = axis_matrix.MAX_COST, pixel_per_clock = g_pixel_per_clock)
+    elif isinstance(tests, str):
+        tests = tests.split(",")
+    testcase = tests or [
+        "run_axi_lite",
+        "run_axi_lite_random_tvalid",
+        "run_axi_lite_random_tready",
+        "run_axi_lite_random_tvalid_random_tready",
+    ]
+    # generated tests selected by MATRIX_FILTER, compatible with G_PIXEL_PER_CLOCK
+    if not tests and MATRIX_FILTER is not None:
+        testcase = axis_matrix.select(MATRIX_FILTER, MATRIX_MAX_COST, g_pixel_per_clock, MATRIX_ORDER)
+
+    # environment of the simulation in test_dir. variables set in the shell override these (see cocotb runner)
+    def sim_env(test_dir):
+        return {
             # writes result pnm image to disk if "True"
             # use this in combination with a specified testcase
             "WRITE_IMAGE_OUTPUT": "False",
-        },
-        testcase = [
-            "run_axi_lite",
-            "run_axi_lite_random_tvalid",
-            "run_axi_lite_random_tready",
-            "run_axi_lite_random_tvalid_random_tready",
-        ]
-    )
+            # format of written images. "P3" (ASCII) or "P6" (binary, much faster for large images).
+            # greyscale "P2"/"P5" only for G_N_COLOR_COMPONENTS=1
+            "IMAGE_OUTPUT_FORMAT": "P3",
+            # directory of written images
+            "IMAGE_OUTPUT_DIR": str(test_dir / "output"),
+            # compares every received line against its expected line right away if "True"
+            # memory stays bounded and the first mismatch fails the test immediately
+            "STREAMING_SCOREBOARD": "False",
+            # where the reference model is computed: "inline", "thread" or "process"
+            # "thread"/"process" run it in a worker pool in parallel to the simulation.
+            # "process" forks the simulator process, see reference_model._executor()
+            "COCO_EXECUTOR": "inline",
+            # memory-maps the stimulus image and streams its lines from disk if "True"
+            "MMAP_STIMULUS": "False",
+            # parsed stimulus images are kept here in binary form, so later runs skip parsing. "" disables it
+            "STIMULUS_CACHE_DIR": str(proj_path / "sim_build" / "stimulus"),
+            # results of expensive reference kernels (cacheable, see reference_model.register_kernel) are kept here
+            # and reused for the same image, generics and kernel version, e.g. str(proj_path / "sim_build" / "coco").
+            # least recently used results are removed beyond COCO_CACHE_MAX_MB. "" disables it
+            "COCO_CACHE_DIR": "",
+            "COCO_CACHE_MAX_MB": "256",
+            **(env or {}),
+        }
+
+    # incremental regression. tests that passed before with unchanged inputs are not run again but reported as cached.
+    # inputs are the HDL sources, the test module and its helpers, the stimulus images, this runner (seed, arguments),
+    # the generics, the simulator, the cocotb/cocotbext-axi/numpy versions and the effective simulation environment
+    effective_env = regression.effective_env(sim_env(test_dir), FINGERPRINT_ENV, FINGERPRINT_ENV_PREFIXES)
+    key = regression.fingerprint(sim, parameters, [
+        *glob.glob(f"{proj_path}/*.vhd"),
+        *glob.glob(f"{proj_path}/*.py"),
+        *glob.glob(f"{effective_env.get('IMAGE_DIR', proj_path / 'images')}/*"),
+    ], effective_env) if incremental else None
+    cached = [test for test in testcase if test in regression.cached_passes(pass_store, test_dir.name, key)] if incremental else []
+    testcase = [test for test in testcase if test not in cached]
+    if cached:
+        print(f"INFO: {len(cached)} tests cached: {', '.join(cached)}")
+    # results of previous runs are removed, durations and passes are only recorded from the results of this run
+    test_dir.mkdir(parents = True, exist_ok = True)
+    regression.clear_results(test_dir)
+    if not testcase:
+        results_xml = test_dir / "results.xml"
+        regression.add_cached(results_xml, cached)
+        if os.getenv("PYTEST_CURRENT_TEST"):
+            pytest.skip(f"all {len(cached)} tests cached")
+        return results_xml
+
+    def run_test(testcase, test_dir, log_file, runner = runner, plusargs = args["wave_args"] if WAVES == "always" else []):
+        regression.link_executable(sim, build_dir, test_dir, hdl_toplevel)
+        return runner.test(
+            test_module = "test_axis_design",
+            hdl_toplevel = hdl_toplevel,
+            hdl_toplevel_lang = "vhdl",
+            build_dir = build_dir,
+            test_dir = test_dir,
+            parameters = parameters,
+            seed = 1871423625,
+            test_args = [*args["test_args"], *work_args["test_args"]],
+            plusargs = plusargs,
+            extra_env = sim_env(test_dir),
+            testcase = testcase,
+            log_file = log_file
+        )
+
+    # splits the tests into shards that run concurrently, each in its own simulator process.
+    # shards are balanced by the test durations of previous runs
+    def run_shard(testcase, shard_dir, shard_log):
+        shard_runner = get_runner(sim)
+        # test() of some simulators (e.g. nvc) reads the build arguments set by build()
+        shard_runner.build_args = runner.build_args
+        return run_test(testcase, shard_dir, shard_log, shard_runner)
+
+    # re-runs every failed test alone with the same seed, this time dumping a waveform into test_dir/waves/<test>
+    def capture_waves(results_xml):
+        for name, sim_time_ns in regression.failed_tests(results_xml):
+            wave_dir = test_dir / "waves" / name
+            wave_runner = get_runner(sim)
+            wave_runner.build_args = runner.build_args
+            try:
+                run_test([name], wave_dir, wave_dir / "sim.log", wave_runner,
+                         regression.wave_args(sim, wave_dir, WAVE_SIGNALS, sim_time_ns + WAVE_MARGIN_NS))
+            except SystemExit:
+                # the test fails again (or is stopped). the waveform is written anyway
+                pass
+            print(f"INFO: Waveform of failed test {name} in {wave_dir}")
+
+    try:
+        if shards <= 1:
+            results_xml = run_test(testcase, test_dir, log_file)
+        else:
+            results_xml = regression.run_shards(
+                run_shard,
+                testcase,
+                shards,
+                test_dir,
+                regression.load_durations(results_store).get(test_dir.name, {}),
+                log_file
+            )
+        regression.add_cached(results_xml, cached)
+        return results_xml
+    finally:
+        # wall time and simulated time of every test are stored for scheduling, also if tests failed
+        regression.record_durations(results_store, test_dir.name, regression.results_file(test_dir))
+        if incremental:
+            regression.record_passes(pass_store, test_dir.name, key, regression.results_file(test_dir))
+        if WAVES == "on_failure":
+            capture_waves(regression.results_file(test_dir))
+
+
+def run_matrix(workers = os.cpu_count(), fail_fast = False):
+    # Runs all generics combinations in parallel without pytest. Every combination is its own simulator process.
+    # Results and logs are merged into sim_run/results.xml and sim_run/regression.log
+    #
+    # Combinations are scheduled by the durations of previous runs in RESULTS_STORE: longest first, so the
+    # longest combination does not start last. With fail_fast cheapest first instead and the regression
+    # stops at the first failing combination
+    proj_path = Path(__file__).resolve().parent
+    (proj_path / "sim_run").mkdir(exist_ok=True)
+
+    names = {generics: regression.run_id(dict(zip(["G_DATA_WIDTH", "G_N_COLOR_COMPONENTS", "G_PIXEL_PER_CLOCK"], generics)))
+             for generics in itertools.product(G_DATA_WIDTH, G_N_COLOR_COMPONENTS, G_PIXEL_PER_CLOCK)}
+    durations = regression.load_durations(RESULTS_STORE)
+    schedule = sorted(names, key=lambda generics: regression.expected_duration(durations.get(names[generics], {})), reverse=not fail_fast)
+
+    def run_combination(generics):
+        log_file = proj_path / "sim_run" / f"{names[generics]}.log"
+        try:
+            results_xml = run(*generics, log_file = log_file)
+        except (Exception, SystemExit) as error:
+            # e.g. the simulator crashed. the other combinations keep running
+            print(f"ERROR: {names[generics]} terminated abnormally: {error}")
+            results_xml = None
+        # a combination without results file is merged as failed
+        if results_xml is not None and not Path(results_xml).is_file():
+            results_xml = None
+        return names[generics], results_xml, log_file
+
+    results = []
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(run_combination, generics) for generics in schedule]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if fail_fast and (results[-1][1] is None or get_results(results[-1][1])[1]):
+                print(f"ERROR: {results[-1][0]} failed. Cancelling remaining combinations")
+                pool.shutdown(cancel_futures = True)
+                break
+
+    # keeps the schedule order in the merged results
+    results.sort(key = lambda result: [names[generics] for generics in schedule].index(result[0]))
+    n_tests, n_failed = regression.merge_results(results, proj_path / "sim_run" / "results.xml", proj_path / "sim_run" / "regression.log")
+    print(f"INFO: TESTS={n_tests} PASS={n_tests-n_failed} FAIL={n_failed}. Merged results in {proj_path / 'sim_run'}")
+    return n_failed == 0
+
+
+@pytest.mark.parametrize("g_data_width", G_DATA_WIDTH, ids=[f" G_DATA_WIDTH={i} " for i in G_DATA_WIDTH])
+@pytest.mark.parametrize("g_n_color_components", G_N_COLOR_COMPONENTS, ids=[f" G_N_COLOR_COMPONENTS={i} " for i in G_N_COLOR_COMPONENTS])
+@pytest.mark.parametrize("g_pixel_per_clock", G_PIXEL_PER_CLOCK, ids=[f" G_PIXEL_PER_CLOCK={i} " for i in G_PIXEL_PER_CLOCK])
+def test_axis_design_runner(
+    g_data_width,
+    g_n_color_components,
+    g_pixel_per_clock
+):
+    run(g_data_width, g_n_color_components, g_pixel_per_clock)
 
 
 if __name__ == "__main__":
 
+    ## Runs all generics combinations in parallel on all cores
+    # python test_runner.py --parallel
+    ## Runs cheapest combinations first and stops at the first failing one
+    # python test_runner.py --parallel --fail-fast
+    if "--parallel" in sys.argv:
+        sys.exit(0 if run_matrix(fail_fast = "--fail-fast" in sys.argv) else 1)
+
     ## Default. Runs testcase
     # python test_runner.py
     test_axis_design_runner(
@@ -78,3 +303,19 @@ if __name__ == "__main__":
 
     ## Runs all testcases as parameterized
     # pytest -v test_runner.py
+    ## Runs all testcases as parameterized in parallel (pytest-xdist)
+    # pytest -v -n auto test_runner.py
+    ## Additionally splits the tests of every combination into 4 shards running concurrently
+    # SHARDS=4 pytest -v test_runner.py
+    ## Only runs tests whose inputs changed since they last passed
+    # INCREMENTAL=True pytest -v test_runner.py
+    ## Runs with the nvc simulator instead of GHDL
+    # SIM=nvc pytest -v test_runner.py
+    ## Runs all tests, including the generated run_axi_stream tests
+    # TESTS=all pytest -v test_runner.py
+    ## Runs the generated 20x10 run_axi_stream tests, cheapest first
+    # MATRIX_FILTER=_20x10 pytest -v test_runner.py
+    ## Runs all generated run_axi_stream tests up to an estimated cost, including large images and long sequences
+    # MATRIX_FILTER=".*" MATRIX_MAX_COST=1000000 pytest -v test_runner.py
+    ## Dumps waveforms of all tests instead of re-running failed tests with a waveform
+    # WAVES=always pytest -v test_runner.py
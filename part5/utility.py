@@ -1,4 +1,9 @@
+import hashlib
 import math
+import mmap
+import os
+from pathlib import Path
+import numpy as np
 
 def power_of_two(value):
     # Add 1 to value to get the actual power of 2
@@ -12,59 +17,241 @@ def power_of_two(value):
     return result
 
 
+def fitted_dtype(bit_width):
+    # Smallest unsigned NumPy type that holds a value of bit_width bits.
+    # Anything wider than 64 bits (e.g. 4 PPC * 3 * 16 bit) is kept as Python int objects
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if bit_width <= np.iinfo(dtype).bits:
+            return np.dtype(dtype)
+    return np.dtype(object)
+
+
+# PNM formats. magic number -> (number of color components, binary)
+PNM_FORMATS = {
+    'P2': (1, False), # ASCII greymap
+    'P3': (3, False), # ASCII pixmap (e.g. RGB)
+    'P5': (1, True),  # binary greymap
+    'P6': (3, True),  # binary pixmap (e.g. RGB)
+}
+
+
+def _read_header(f, n_fields):
+    # Read whitespace separated header fields, skipping comments. Exactly one whitespace follows the last field
+    fields = []
+    field = b''
+    while len(fields) < n_fields:
+        char = f.read(1)
+        if not char:
+            raise ValueError("Unexpected end of file in PNM header")
+        if char == b'#':
+            f.readline()
+        elif char.isspace():
+            if field:
+                fields.append(field.decode())
+                field = b''
+        else:
+            field += char
+    return fields
+
+
+def _sample_dtype(max_value):
+    # binary samples are 1 byte, or 2 bytes big endian for max_value > 255
+    return np.dtype('>u2') if max_value > 255 else np.dtype('u1')
+
+
+def combine_components(samples, bit_depth):
+    # (..., n_color_components) samples -> (...) pixel values. first component (e.g. R) in the MSBs
+    n_color_components = samples.shape[-1]
+    shifts = np.array([(n_color_components-1-idx)*bit_depth for idx in range(n_color_components)], dtype=np.uint64)
+    pixels = np.bitwise_or.reduce(np.asarray(samples).astype(np.uint64) << shifts, axis=-1)
+    return pixels.astype(fitted_dtype(n_color_components*bit_depth))
+
+
+def split_components(pixels, n_color_components, bit_depth):
+    # (...) pixel values -> (..., n_color_components) samples. inverse of combine_components()
+    shifts = np.array([(n_color_components-1-idx)*bit_depth for idx in range(n_color_components)], dtype=np.uint64)
+    samples = (np.asarray(pixels).astype(np.uint64)[..., None] >> shifts) & np.uint64(2**bit_depth-1)
+    return samples.astype(fitted_dtype(bit_depth))
+
+
 def read_pnm(file_path):
+    # pixel data as flat list of Python ints. see read_pnm_array() for a NumPy array without the conversion
+    data, width, height, max_value = read_pnm_array(file_path)
+    return (data.tolist(), width, height, max_value)
+
+
+def read_pnm_array(file_path):
     with open(file_path, 'rb') as f:
-        # Read header
-        magic_number = f.readline().decode().strip()
-        if magic_number not in ['P3']:
+        # Read header: magic number, width, height and max value
+        magic_number, width, height, max_value = _read_header(f, 4)
+        if magic_number not in PNM_FORMATS:
             raise ValueError("Invalid PNM format")
-
-        # Parse width, height, and max grey value if applicable
-        width, height = map(int, f.readline().decode().split())
-        max_value = None
-        if magic_number in ['P3']:
-            max_value = int(f.readline().decode())
+        width, height, max_value = int(width), int(height), int(max_value)
+        n_color_components, binary = PNM_FORMATS[magic_number]
 
         bit_depth = power_of_two(max_value)
 
-        # Read image data
-        data = []
-        # ASCII formats
-        if magic_number in ['P3']:
-            for line in f:
-                # Combine three numbers into one
-                values = [int(x) for x in line.decode().split()] # list of three numbers (e.g. RGB)
-                pixel = (values[0] << (2*bit_depth)) | (values[1] << bit_depth) | values[2]
-                data.append(pixel)
+        # Read image data. all color component samples in one bulk decode
+        n_samples = width*height*n_color_components
+        if binary:
+            dtype = _sample_dtype(max_value)
+            raw = f.read(n_samples*dtype.itemsize)
+            if len(raw) != n_samples*dtype.itemsize:
+                raise ValueError(f"PNM data too short. Expected {n_samples} samples")
+            samples = np.frombuffer(raw, dtype=dtype)
         else:
-            for line in f:
-                data.extend([int(x) for x in line.decode().split()])
+            samples = np.array(f.read().split(), dtype=np.uint32)
+            if samples.size != n_samples:
+                raise ValueError(f"PNM data has {samples.size} samples but expected {n_samples}")
+
+        # Combine color components into one number per pixel (e.g. RGB)
+        data = combine_components(samples.reshape(-1, n_color_components), bit_depth)
 
         return (data, width, height, max_value)
 
 
+# Images parsed by read_pnm_cached() in this process. (path, modification time, size) -> (data, width, height, max_value)
+_pnm_cache = {}
+
+
+def read_pnm_cached(file_path, cache_dir=None):
+    """
+    read_pnm_array() that parses every file only once per process, e.g. once per simulation for all tests.
+    Every caller gets the same read-only pixel array. Optionally, parsed images are also kept on disk in
+    a compact binary form keyed by file content hash, so later processes don't parse the file at all
+
+    :param file_path: path of the PNM file
+    :param cache_dir: (optional) directory of the on-disk cache. None to only cache in this process
+    :return: (data, width, height, max_value) like read_pnm_array(), data being read-only
+    """
+    stat = Path(file_path).stat()
+    key = (str(Path(file_path).resolve()), stat.st_mtime_ns, stat.st_size)
+    if key not in _pnm_cache:
+        _pnm_cache[key] = _read_pnm_disk_cached(file_path, cache_dir) if cache_dir else read_pnm_array(file_path)
+        _pnm_cache[key][0].flags.writeable = False
+    return _pnm_cache[key]
+
+
+def _read_pnm_disk_cached(file_path, cache_dir):
+    digest = hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+    cache_file = Path(cache_dir) / f"{digest}.npz"
+    if cache_file.is_file():
+        with np.load(cache_file) as cached:
+            width, height, max_value = cached['header'].tolist()
+            return (cached['data'], width, height, max_value)
+
+    data, width, height, max_value = read_pnm_array(file_path)
+    # pixels wider than 64 bits are Python ints, those are not cached on disk
+    if data.dtype != object:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        # written under a temporary name first, parallel simulations may read the same cache
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp_file, data=data, header=np.array([width, height, max_value]))
+        tmp_file.replace(cache_file)
+    return (data, width, height, max_value)
+
 
 def write_pnm(data, width, height, max_value, file_path, format):
-    if format not in ['P3']:
-        raise ValueError("Unsupported PNM format. Use 'P3' for ASCII")
+    if format not in PNM_FORMATS:
+        raise ValueError(f"Unsupported PNM format. Use one of {list(PNM_FORMATS)}. 'P2'/'P3' for ASCII, 'P5'/'P6' for binary")
+    n_color_components, binary = PNM_FORMATS[format]
 
     bit_depth = power_of_two(max_value)
 
-    _data = []
-    for value in data:
-        # Split one number into three (e.g. RGB)
-        _data.append(value >> (2*bit_depth))
-        _data.append(value >> bit_depth & max_value)
-        _data.append(value & max_value)
-
-    with open(file_path, 'w') as f:
-        # Write header
-        f.write(f"{format}\n")
-        f.write(f"{width} {height}\n")
-        f.write(f"{max_value}\n")
-
-        if format == 'P3':  # ASCII format
-            for idx,value in enumerate(_data, 1):
-                f.write(f"{value} ")
-                if idx % 3 == 0: # 3 color components!
-                    f.write("\n")
+    # Split one number per pixel into its color components (e.g. RGB)
+    samples = split_components(data, n_color_components, bit_depth)
+
+    # Header
+    header = f"{format}\n{width} {height}\n{max_value}\n".encode()
+
+    # Image data. one pixel per line for ASCII formats
+    with open(file_path, 'wb') as f:
+        f.write(header)
+        if binary:
+            f.write(samples.astype(_sample_dtype(max_value)).tobytes())
+        else:
+            # formatted one image line at a time, so no format tuple of the whole image is built
+            line_format = (("%d " * n_color_components) + "\n") * width
+            for line in samples.reshape(height, -1).tolist():
+                f.write((line_format % tuple(line)).encode())
+
+
+class MappedPnm:
+
+    def __init__(self, samples, max_value):
+        """
+        Lazily decoded view on the pixels of one PNM image. Lines are only read and combined when accessed
+
+        :param samples: (height x width x n_color_components) array of samples, e.g. memory-mapped from the file
+        :param max_value: maximum sample value of the image
+        """
+        self.samples = samples
+        self.height, self.width = samples.shape[:2]
+        self.max_value = max_value
+        self.bit_depth = power_of_two(max_value)
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def __len__(self):
+        # number of pixels, like the flattened data list of read_pnm()
+        return self.height*self.width
+
+    def __getitem__(self, line_idx):
+        # one line of combined pixel values
+        return combine_components(self.samples[line_idx], self.bit_depth)
+
+    def __array__(self, dtype=None, copy=None):
+        # decodes the whole image
+        pixels = combine_components(self.samples, self.bit_depth)
+        return pixels if dtype is None else pixels.astype(dtype)
+
+
+def map_pnm(file_path):
+    """
+    Memory-map a PNM file. Binary files (P5/P6) may contain several images one after another, e.g. a video sequence.
+    ASCII files cannot be decoded lazily and are parsed right away
+
+    :param file_path: path of the PNM file
+    :return: list of (data, width, height, max_value) per image, data being a MappedPnm
+    """
+    with open(file_path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    images = []
+    while buffer.tell() < len(buffer):
+        magic_number, width, height, max_value = _read_header(buffer, 4)
+        if magic_number not in PNM_FORMATS:
+            raise ValueError("Invalid PNM format")
+        width, height, max_value = int(width), int(height), int(max_value)
+        n_color_components, binary = PNM_FORMATS[magic_number]
+
+        shape = (height, width, n_color_components)
+        if binary:
+            dtype = _sample_dtype(max_value)
+            samples = np.frombuffer(buffer, dtype=dtype, count=math.prod(shape), offset=buffer.tell()).reshape(shape)
+            buffer.seek(buffer.tell() + samples.nbytes)
+        else:
+            samples = np.array(buffer.read().split(), dtype=np.uint32).reshape(shape)
+        images.append((MappedPnm(samples, max_value), width, height, max_value))
+
+        # skip whitespace between concatenated images
+        while buffer.tell() < len(buffer) and buffer[buffer.tell():buffer.tell()+1].isspace():
+            buffer.seek(1, 1)
+
+    return images
+
+
+def map_pnm_sequence(path):
+    """
+    Memory-map a video sequence. Either one PNM file with several images or a directory of PNM files (sorted by name).
+    Files are only mapped when the sequence reaches them
+
+    :param path: path of a PNM file or a directory
+    :return: generator of (data, width, height, max_value) per image, data being a MappedPnm
+    """
+    path = Path(path)
+    files = sorted(path.glob("*.pnm")) if path.is_dir() else [path]
+    for file_path in files:
+        yield from map_pnm(file_path)